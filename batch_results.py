@@ -0,0 +1,200 @@
+"""
+Runs compute_results, event_decision_time and tlx for every session snapshot in backups/ in parallel and combines
+the per-user results into one dataset tagged by session.
+
+Each session runs in its own worker process, so the total time is bounded by the slowest session. Console output
+of each session is captured and printed in session order once all sessions are done.
+
+The backups are snapshots of one database, so a later snapshot also holds the participants of the earlier ones. The
+combined dataset counts every participant once, in the latest session whose results include them: that snapshot
+holds their complete record, with every correction made since.
+
+Sessions are the workbooks in backups/, analyzed with their corrections from patches/ if they have any, plus any
+Postgres dump that no workbook was exported from. Copies of a session's workbook, named with one of COPY_SUFFIXES,
+are analyzed once, from the most preferred copy: a '_corrected' workbook supersedes the original, and an annotated
+' + charts' copy is only used when it is the only one. A workbook counts as exported from a dump when their timestamps
+are less than a minute apart. Such dumps are restored into their own database and analyzed in SQL (see compute_results).
+
+When run as a script, each session's results are also saved to the results_store under the session's file name.
+"""
+import argparse
+import contextlib
+import io
+import os
+import re
+import shlex
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from subprocess import Popen
+from typing import List, Optional, Tuple
+
+import pandas as pd
+
+from compute_results import (EXCEL_DIR, PG_DATABASE, PG_HOST, PG_PASSWORD, PG_USERNAME, compute_results,
+                             event_decision_time, tlx)
+from download_and_import import restore_snapshot
+from patches import patch_file
+from results_store import save_results
+
+BACKUP_DIR = Path('backups')
+# Suffixes of the workbook copies of one session, most preferred first
+COPY_SUFFIXES = ['_corrected', '', ' + charts']
+_LABELED = re.compile(r'^.+?_\d{8}_\d{2}-\d{2}-\d{2}[-_](?P<label>.+)$')
+
+
+def _timestamp(path: Path) -> Optional[datetime]:
+    """
+    :return: the snapshot time in a name such as cry-wolf_20191021_13-51-49_MIS310.xlsx, None if there is none
+    """
+    parts = path.stem.split('_')
+    try:
+        return datetime.strptime(f'{parts[1]}_{parts[2][:8]}', '%Y%m%d_%H-%M-%S')
+    except (IndexError, ValueError):
+        return None
+
+
+def _snapshot_order(session: Path) -> Tuple[datetime, str]:
+    """
+    :return: sort key that orders sessions by snapshot time; sessions without one come first
+    """
+    return _timestamp(session) or datetime.min, session.name
+
+
+def _copy_of(workbook: Path) -> Tuple[str, int]:
+    """
+    :return: (the session the workbook is a copy of, preference of the copy in COPY_SUFFIXES). Sessions with a label,
+        such as MIS310 in cry-wolf_20191021_13-51-49_MIS310.xlsx, are identified by it, since corrected copies are
+        saved under a new timestamp; unlabeled sessions by their file name.
+    """
+    stem, preference = workbook.stem, COPY_SUFFIXES.index('')
+    for i, suffix in enumerate(COPY_SUFFIXES):
+        if suffix and stem.endswith(suffix):
+            stem, preference = stem[:-len(suffix)], i
+            break
+    match = _LABELED.match(stem)
+    return (match.group('label') if match else stem), preference
+
+
+def find_sessions(backup_dir: Path = BACKUP_DIR) -> List[Path]:
+    """
+    :return: the workbooks and dumps in backup_dir to analyze, see the module docstring
+    """
+    workbooks = sorted(backup_dir.glob('*.xlsx'))
+    preferred = {}
+    for workbook in workbooks:
+        session, preference = _copy_of(workbook)
+        # Among equally preferred copies the latest wins
+        if session not in preferred or preference <= preferred[session][0]:
+            preferred[session] = (preference, workbook)
+    sessions = sorted(workbook for _, workbook in preferred.values())
+
+    exported = [_timestamp(w) for w in workbooks]
+    for dump in sorted(backup_dir.glob('*.dump')):
+        stamp = _timestamp(dump)
+        if stamp is None or not any(t and abs((t - stamp).total_seconds()) < 60 for t in exported):
+            sessions.append(dump)
+    return sessions
+
+
+def _restore(dump: Path) -> str:
+    """
+    Restores a dump into a database of its own, named after the dump's timestamp.
+    :return: the SQLAlchemy URL of that database
+    """
+    database = f"{PG_DATABASE}_{dump.stem.split('_', 1)[-1].replace('-', '_').lower()}"
+    os.environ["PGPASSWORD"] = PG_PASSWORD
+    # Fails harmlessly if the database exists; pg_restore --clean then replaces its contents
+    Popen(shlex.split(f"createdb -h {PG_HOST} -U {PG_USERNAME} {database}")).wait()
+    restore_snapshot(dump, PG_PASSWORD, PG_HOST, PG_USERNAME, database)
+    return f'postgresql+psycopg2://{PG_USERNAME}:{PG_PASSWORD}@{PG_HOST}/{database}'
+
+
+def analyze_session(session: Path):
+    """
+    Runs the per-session analysis, capturing everything it prints.
+    :return: (users, decision time, captured output); users and decision time are None if the analysis failed
+    """
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        try:
+            if session.suffix == '.dump':
+                source = _restore(session)
+            elif patch_file(session.stem).exists():
+                source = f'{session.stem}_patched'
+            else:
+                source = session.stem
+            users = compute_results(source)
+            decision_time = event_decision_time(source, users[['username', 'group', '25th percentile']])
+        except Exception:
+            traceback.print_exc(file=log)
+            return None, None, log.getvalue()
+        # The TLX comparison is only printed, so the session's results are kept even if it fails, e.g., when a group
+        # has no survey answers
+        try:
+            tlx(source, users[['username', 'group', '25th percentile']])
+        except Exception:
+            traceback.print_exc(file=log)
+        return users, decision_time, log.getvalue()
+
+
+def batch_results(sessions: List[Path] = None, workers: int = None):
+    """
+    Analyzes sessions in parallel.
+    :param sessions: workbooks and dumps to analyze; defaults to find_sessions()
+    :param workers: number of worker processes; defaults to one per session, up to the number of CPUs
+    :return: (users, decision_time): users of every session with a leading 'session' column, each counted once, and
+        the per-user time to decide by decision order with (session, username) columns
+    """
+    sessions = find_sessions() if sessions is None else sessions
+    workers = workers or min(len(sessions), os.cpu_count())
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(analyze_session, sessions))
+
+    # Snapshots are cumulative: each participant's results and decision times are taken from the latest session that
+    # has them. The decision times also cover users compute_results leaves out, so they are matched on their own.
+    users_in, timed_in = {}, {}
+    by_time = sorted(zip(sessions, results), key=lambda result: _snapshot_order(result[0]))
+    for session, (session_users, decision_time, _) in by_time:
+        if session_users is not None:
+            users_in.update(dict.fromkeys(session_users['username'], session))
+            timed_in.update(dict.fromkeys(decision_time.columns.drop('mean'), session))
+
+    users, decision_times = {}, {}
+    for session, (session_users, decision_time, log) in zip(sessions, results):
+        print(f"======== {session.stem}")
+        print(log)
+        if session_users is None:
+            print(f"Session {session.stem} failed and is left out of the combined results.")
+            continue
+        repeated = session_users['username'].map(users_in) != session
+        if repeated.any():
+            print(f"{repeated.sum()} participants of {session.stem} are counted in a later session.")
+        users[session.stem] = session_users[~repeated]
+        decision_time = decision_time.drop(columns='mean')
+        decision_times[session.stem] = decision_time[[c for c in decision_time.columns if timed_in[c] == session]]
+
+    users = pd.concat(users, names=['session']).reset_index(level='session').reset_index(drop=True)
+    decision_time = pd.concat(decision_times, axis=1, names=['session', 'username'])
+    return users, decision_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sessions', nargs='*', type=Path,
+                        help=f'workbooks or dumps to analyze, default: every session in {BACKUP_DIR}/')
+    parser.add_argument('--workers', type=int, help='number of worker processes')
+    args = parser.parse_args()
+
+    _users, _decision_time = batch_results(args.sessions or None, args.workers)
+    for _session, _session_users in _users.groupby('session', sort=False):
+        save_results(_session, _session_users.drop(columns='session'), _decision_time[_session])
+
+    excel_dir = Path(EXCEL_DIR)
+    if not os.path.exists(excel_dir):
+        os.makedirs(excel_dir)
+    excel_file = excel_dir / "all_sessions_analysis.xlsx"
+    with pd.ExcelWriter(excel_file, engine='openpyxl', datetime_format='hh:mm:ss') as writer:
+        _users.to_excel(writer, sheet_name="users", index=False)
+        _decision_time.to_excel(writer, sheet_name="event_decision_time")
@@ -0,0 +1,124 @@
+"""
+Scaling benchmark of the analysis on synthetic data sets (see synthetic_data.py).
+
+For each scale a synthetic session is loaded into a fresh SQLite database, and compute_results, event_decision_time,
+tlx, the event_stats item analysis and the dump_db_to_excel export are run against it. Every stage runs in a forked
+worker process, which reports the stage's wall time and how far its peak resident set size rose above the size it
+started with. Output of the stages is suppressed.
+
+Usage: python benchmark.py [--scales 100 10000 1000000] [--seed SEED] [--csv FILE]
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, List
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from compute_results import (CHECK_EVENT_IDS, Event, EventDecision, compute_results, event_decision_time,
+                             label_decisions, normalize_answer, read_table, tlx)
+from dump_db_to_excel import write_workbook
+from item_analysis import analyze_items
+from synthetic_data import SEED, generate, to_database
+
+SCALES = [10 ** 2, 10 ** 4, 10 ** 6]
+
+
+def _peak_rss_mib() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def _run_stage(stage: Callable, args: tuple):
+    with contextlib.redirect_stdout(io.StringIO()):
+        start_rss = _peak_rss_mib()
+        start = time.perf_counter()
+        result = stage(*args)
+        seconds = time.perf_counter() - start
+    return result, seconds, _peak_rss_mib() - start_rss
+
+
+def _measure(stage: Callable, *args):
+    """
+    Runs stage(*args) in a forked process, so its peak memory is not hidden by earlier stages.
+    :return: (result, wall seconds, peak RSS growth in MiB)
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork')) as pool:
+        return pool.submit(_run_stage, stage, args).result()
+
+
+def dump(source: str, excel_file: Path):
+    """
+    The dump_db_to_excel export, on any source
+    """
+    write_workbook(create_engine(source), excel_file)
+
+
+def item_analysis(source: str, users: pd.DataFrame) -> pd.DataFrame:
+    """
+    The event difficulty and discrimination analysis of event_stats.py, on any source
+    """
+    events = read_table(source, Event)
+    events = events[~events['id'].isin(CHECK_EVENT_IDS)]
+    events['should_escalate'] = events.apply(normalize_answer, axis=1)
+    event_decisions = read_table(source, EventDecision)
+    event_decisions = event_decisions[~event_decisions.event_id.isin(CHECK_EVENT_IDS)] \
+        .sort_values('time_event_decision').drop_duplicates(subset=['user', 'event_id'], keep='last')
+    labeled = label_decisions(events, event_decisions)
+    return analyze_items(labeled, users.rename(columns={'username': 'user'}))
+
+
+def benchmark(scales: List[int] = SCALES, seed: int = SEED) -> pd.DataFrame:
+    """
+    :return: one row per scale and stage with the number of decisions, the rows the stage returned, wall seconds
+        and peak RSS growth in MiB
+    """
+    rows = []
+    for n in scales:
+        tables = generate(n, seed)
+        n_decisions = len(tables['EventDecision'])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = f"sqlite:///{Path(tmp_dir) / 'synthetic.db'}"
+            start = time.perf_counter()
+            to_database(tables, source)
+            rows.append((n_decisions, 'load', n_decisions, time.perf_counter() - start, None))
+            del tables
+
+            users, seconds, peak = _measure(compute_results, source)
+            rows.append((n_decisions, 'compute_results', len(users), seconds, peak))
+            groups = users[['username', 'group', '25th percentile']]
+            stages = [('event_decision_time', event_decision_time, (source, groups)),
+                      ('tlx', tlx, (source, groups)),
+                      ('item_analysis', item_analysis, (source, users[['username', 'group', 'correctness']])),
+                      ('dump_db_to_excel', dump, (source, Path(tmp_dir) / 'synthetic.xlsx'))]
+            for name, stage, args in stages:
+                result, seconds, peak = _measure(stage, *args)
+                rows.append((n_decisions, name, None if result is None else len(result), seconds, peak))
+            print(_table(rows[-len(stages) - 2:]).to_string(index=False, float_format=lambda x: f'{x:.2f}'))
+    return _table(rows)
+
+
+def _table(rows: list) -> pd.DataFrame:
+    table = pd.DataFrame(rows, columns=['decisions', 'stage', 'rows', 'seconds', 'peak RSS MiB'])
+    return table.astype({'rows': 'Int64', 'peak RSS MiB': float})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=SCALES, help='numbers of decisions to generate')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--csv', type=Path, help='also write the results to this CSV file')
+    args = parser.parse_args()
+
+    results = benchmark(args.scales, args.seed)
+    if args.csv:
+        results.to_csv(args.csv, index=False)
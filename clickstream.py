@@ -0,0 +1,177 @@
+"""
+Per-user timeline index over the EventClicked and EventDecision tables.
+
+Timeline.build sorts each table once by user and time into int64 nanosecond timestamp arrays with integer user codes
+and event ids, and once more by user, event and time. Every query is then answered with searchsorted and reduceat
+over those arrays:
+- visits(): clicks, visits, revisits and dwell time per user and event. A visit is a run of consecutive clicks of a
+  user on one event; a click's dwell time lasts until the user's next click, or for their last click until their last
+  decision.
+- navigation(): the order in which each user visited the events
+- decisions(): for every decision its submission number on the event (0 for the first, 1 for the first resubmission,
+  ...) and the seconds since the user's latest click on the event and since their first click on it
+
+Timestamps of both tables are ranked together, so "latest click at or before a decision" is a single searchsorted on
+(user, event, time rank) keys. Rows without a time are left out; both tables must keep at least one row.
+"""
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented
+
+_NS_PER_S = 1e9
+
+
+def _sort(df: pd.DataFrame, users: pd.Index, time_col: str):
+    """
+    :return: (user codes, event ids, int64 times) of df's rows with a time, sorted by user then time
+    """
+    stamps = df[time_col].to_numpy('datetime64[ns]')
+    valid = ~np.isnat(stamps)
+    times = stamps.view(np.int64)
+    user = users.get_indexer(df['user'].astype(object).to_numpy()[valid])
+    event = df['event_id'].to_numpy(np.int64)[valid]
+    times = times[valid]
+    order = np.lexsort((times, user))
+    return user[order], event[order], times[order]
+
+
+def _offsets(user: np.ndarray, n_users: int) -> np.ndarray:
+    """
+    :return: start of each user's rows in an array sorted by user, followed by its length
+    """
+    return np.searchsorted(user, np.arange(n_users + 1))
+
+
+class Timeline:
+    """
+    The clickstream and decisions of every user of a session, see the module docstring.
+    """
+
+    def __init__(self, users: pd.Index, click_user, click_event, click_time, decision_user, decision_event,
+                 decision_time):
+        self.users = users
+        self.click_user, self.click_event, self.click_time = click_user, click_event, click_time
+        self.decision_user, self.decision_event, self.decision_time = decision_user, decision_event, decision_time
+        self.click_offsets = _offsets(click_user, len(users))
+        self.decision_offsets = _offsets(decision_user, len(users))
+
+        # (user, event) pair keys, and both tables' times ranked together so one int64 key orders by pair then time
+        self._n_events = int(max(click_event.max(initial=0), decision_event.max(initial=0))) + 1
+        click_pair = click_user * self._n_events + click_event
+        decision_pair = decision_user * self._n_events + decision_event
+        _, ranks = np.unique(np.concatenate([click_time, decision_time]), return_inverse=True)
+        self._n_ranks = int(ranks.max(initial=0)) + 1
+        click_key = click_pair * self._n_ranks + ranks[:len(click_time)]
+        self._decision_key = decision_pair * self._n_ranks + ranks[len(click_time):]
+
+        # Clicks by user, event and time: the permutation into the by-user arrays, and where each pair's clicks start
+        self._by_pair = np.argsort(click_key, kind='stable')
+        self._click_key = click_key[self._by_pair]
+        pairs = click_pair[self._by_pair]
+        self._pair_starts = np.flatnonzero(np.r_[True, pairs[1:] != pairs[:-1]])
+        self._pairs = pairs[self._pair_starts]
+
+    @classmethod
+    @instrumented('build timeline')
+    def build(cls, clicks: pd.DataFrame, decisions: pd.DataFrame) -> 'Timeline':
+        """
+        :param clicks: EventClicked table with 'user', 'event_id' and 'time_event_click' columns
+        :param decisions: EventDecision table with 'user', 'event_id' and 'time_event_decision' columns
+        """
+        users = pd.Index(pd.unique(np.concatenate([clicks['user'].astype(object).to_numpy(),
+                                                   decisions['user'].astype(object).to_numpy()]))).sort_values()
+        return cls(users, *_sort(clicks, users, 'time_event_click'), *_sort(decisions, users, 'time_event_decision'))
+
+    def _frame(self, user: np.ndarray, columns: dict) -> pd.DataFrame:
+        return pd.DataFrame({'user': self.users[user], **columns})
+
+    def _dwell(self) -> np.ndarray:
+        """
+        :return: dwell time of every click in the by-user order, in nanoseconds; NaN where it is unknown
+        """
+        user, times = self.click_user, self.click_time
+        same_user = np.r_[user[1:] == user[:-1], False]
+        # A user's last click lasts until their last decision, if that came later
+        ends = self.decision_offsets[1:]
+        has_decisions = ends > self.decision_offsets[:-1]
+        last_decision = np.full(len(self.users), np.iinfo(np.int64).min)
+        last_decision[has_decisions] = self.decision_time[ends[has_decisions] - 1]
+        end = np.where(same_user, np.r_[times[1:], 0], last_decision[user])
+        return np.where(end > times, end - times, np.NaN).astype(float)
+
+    def _new_visit(self) -> np.ndarray:
+        """
+        :return: whether each click, in the by-user order, starts a visit
+        """
+        user, event = self.click_user, self.click_event
+        return np.r_[True, (user[1:] != user[:-1]) | (event[1:] != event[:-1])]
+
+    def visits(self) -> pd.DataFrame:
+        """
+        :return: one row per user and clicked event with the columns user, event_id, clicks, visits, revisits
+            (visits - 1) and dwell (total seconds spent on the event; NaN dwell times count as 0)
+        """
+        starts = self._pair_starts
+        dwell = np.nan_to_num(self._dwell())[self._by_pair]
+        visits = self._new_visit()[self._by_pair]
+        clicks = np.diff(np.r_[starts, len(self._by_pair)])
+        n_visits = np.add.reduceat(visits, starts)
+        return self._frame(self._pairs // self._n_events, {
+            'event_id': self._pairs % self._n_events,
+            'clicks': clicks,
+            'visits': n_visits,
+            'revisits': n_visits - 1,
+            'dwell': np.add.reduceat(dwell, starts) / _NS_PER_S,
+        })
+
+    def navigation(self) -> pd.DataFrame:
+        """
+        :return: one row per visit, in each user's visiting order, with the columns user, order (0 for the user's first
+            visit), event_id, time_event_click (of the visit's first click) and dwell (seconds until the next visit)
+        """
+        new_visit = self._new_visit()
+        positions = np.flatnonzero(new_visit)
+        user = self.click_user[positions]
+        dwell = self._dwell()
+        # A visit lasts as long as its clicks together
+        visit = np.cumsum(new_visit) - 1
+        visit_dwell = np.bincount(visit, weights=np.nan_to_num(dwell))
+        unknown = np.bincount(visit, weights=np.isnan(dwell)) > 0
+        return self._frame(user, {
+            'order': np.arange(len(positions)) - np.searchsorted(user, user),
+            'event_id': self.click_event[positions],
+            'time_event_click': self.click_time[positions].view('datetime64[ns]'),
+            'dwell': np.where(unknown, np.NaN, visit_dwell / _NS_PER_S),
+        })
+
+    def decisions(self) -> pd.DataFrame:
+        """
+        :return: one row per decision, by user and time, with the columns user, event_id, time_event_decision,
+            submission, seconds_since_click (since the latest click on the event at or before the decision) and
+            seconds_since_first_click (since the first click on the event, which may come after the decision). The
+            seconds are NaN when the user never clicked the event.
+        """
+        user, event, times = self.decision_user, self.decision_event, self.decision_time
+        # Earlier decisions on the same event; decisions are sorted by time within each user
+        pair = user * self._n_events + event
+        by_pair = np.argsort(pair, kind='stable')
+        sorted_pair = pair[by_pair]
+        submission = np.empty(len(pair), dtype=np.int64)
+        submission[by_pair] = np.arange(len(pair)) - np.searchsorted(sorted_pair, sorted_pair)
+
+        click_times = self.click_time[self._by_pair]
+        latest = np.searchsorted(self._click_key, self._decision_key, side='right') - 1
+        clicked = latest >= 0
+        clicked[clicked] = self._click_key[latest[clicked]] // self._n_ranks == pair[clicked]
+        since_click = np.where(clicked, times - click_times[np.maximum(latest, 0)], np.NaN)
+
+        group = np.minimum(np.searchsorted(self._pairs, pair), len(self._pairs) - 1)
+        since_first = np.where(self._pairs[group] == pair, times - click_times[self._pair_starts[group]], np.NaN)
+        return self._frame(user, {
+            'event_id': event,
+            'time_event_decision': times.view('datetime64[ns]'),
+            'submission': submission,
+            'seconds_since_click': since_click / _NS_PER_S,
+            'seconds_since_first_click': since_first / _NS_PER_S,
+        })
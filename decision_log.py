@@ -0,0 +1,192 @@
+"""
+Compact binary log of the EventDecision and EventClicked tables, read through np.memmap.
+
+A log is a directory with:
+- <Model>.bin for each of LOGGED: fixed-width RECORD rows, in the order they were appended and, within one append,
+  in the source's row order
+- users.txt: the string table of usernames, one per line; a record's 'user' is a line number
+- log.json: the format version, the source the log was fed from, the number of usernames and, per table, the number
+  of records and the largest id appended so far
+
+A RECORD is 16 bytes, with every field naturally aligned: user index (int32), event id (int16), decision (int8, the
+code of the schema.DECISIONS category), confidence (int8) and time (int64 nanoseconds since the epoch, so its view
+as datetime64[ns] is the timestamp). Missing decisions and confidences are MISSING; a missing time is the int64 NaT.
+Clicks have no decision or confidence and store MISSING in both.
+
+append_tables only ever appends: rows with an id above the table's watermark in log.json are encoded and added at
+the end of its file, and log.json is replaced last. Readers map only the records log.json counts, so an interrupted
+append is invisible to them and overwritten by the next one.
+
+Opening a log reads log.json and users.txt and maps the files, so analyses start without parsing anything.
+compute_results.read_table accepts a log directory as its source: the logged tables are decoded from the mapped
+arrays with DecisionLog.frame, and the other tables are read from the log's source. duplicate_decision works on the
+mapped arrays themselves. Logs are written with dump_decision_log.py.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from models import EventClicked, EventDecision
+from schema import DECISIONS
+
+FORMAT_VERSION = 1
+META_FILE = 'log.json'
+USERS_FILE = 'users.txt'
+
+RECORD = np.dtype([('user', '<i4'), ('event_id', '<i2'), ('decision', 'i1'), ('confidence', 'i1'), ('time', '<i8')])
+MISSING = -1
+# Time column of each logged table
+LOGGED = {EventDecision: 'time_event_decision', EventClicked: 'time_event_click'}
+
+
+def is_log(source) -> bool:
+    """
+    :return: True if source is a directory written by append_tables
+    """
+    return (Path(source) / META_FILE).is_file()
+
+
+def _table_file(log_dir: Path, model) -> Path:
+    return log_dir / f'{model.__name__}.bin'
+
+
+def _read_meta(log_dir: Path) -> dict:
+    return json.loads((log_dir / META_FILE).read_text())
+
+
+def _read_users(log_dir: Path, count: int) -> list:
+    file = log_dir / USERS_FILE
+    if not count:
+        return []
+    return file.read_text(encoding='utf-8').split('\n')[:count]
+
+
+class DecisionLog:
+    """
+    A log opened for reading; records(model) is the table's memory-mapped RECORD array.
+    """
+
+    def __init__(self, log_dir):
+        self.log_dir = Path(log_dir)
+        self.meta = _read_meta(self.log_dir)
+        if self.meta['version'] != FORMAT_VERSION:
+            raise ValueError(f'{self.log_dir} has log format {self.meta["version"]}, expected {FORMAT_VERSION}')
+        self.source = self.meta['source']
+        self.users = np.array(_read_users(self.log_dir, self.meta['users']), dtype=object)
+        self._records = {}
+
+    def records(self, model) -> np.ndarray:
+        """
+        :return: the table's records, mapped read-only; empty if none were appended
+        """
+        if model not in self._records:
+            count = self.meta['tables'].get(model.__name__, {}).get('rows', 0)
+            if count:
+                self._records[model] = np.memmap(_table_file(self.log_dir, model), dtype=RECORD, mode='r',
+                                                 shape=(count,))
+            else:
+                self._records[model] = np.empty(0, dtype=RECORD)
+        return self._records[model]
+
+    def frame(self, model) -> pd.DataFrame:
+        """
+        :return: the table with the columns and compact dtypes schema.typed gives it, except for the id column,
+            which is not logged
+        """
+        records = self.records(model)
+        user = pd.Categorical.from_codes(records['user'], categories=self.users)
+        columns = {'user': user.remove_unused_categories(), 'event_id': records['event_id']}
+        if model is EventDecision:
+            confidence = records['confidence']
+            columns['escalate'] = pd.Categorical.from_codes(records['decision'], dtype=DECISIONS)
+            columns['confidence'] = pd.arrays.IntegerArray(confidence, confidence == MISSING)
+        columns[LOGGED[model]] = records['time'].view('datetime64[ns]')
+        return pd.DataFrame(columns)
+
+
+def _encode(model, df: pd.DataFrame, user_codes: Dict[str, int]) -> np.ndarray:
+    """
+    :param user_codes: username -> index in the string table; new usernames are added to it
+    :return: df's rows as RECORDs
+    """
+    records = np.empty(len(df), dtype=RECORD)
+    usernames = df['user'].astype(object).to_numpy()
+    if pd.isna(usernames).any():
+        raise ValueError(f'{model.__name__} has rows without a user')
+    records['user'] = [user_codes.setdefault(u, len(user_codes)) for u in usernames]
+
+    event_id = pd.to_numeric(df['event_id'])
+    if event_id.isna().any() or not event_id.between(0, np.iinfo(np.int16).max).all():
+        raise ValueError(f'{model.__name__} has event ids that do not fit an int16')
+    records['event_id'] = event_id.to_numpy()
+
+    records['decision'] = records['confidence'] = MISSING
+    if model is EventDecision:
+        escalate = df['escalate'].astype(DECISIONS)
+        if (escalate.isna() & df['escalate'].notna()).any():
+            raise ValueError(f'Unknown decisions {sorted(set(df["escalate"].dropna()) - set(DECISIONS.categories))}')
+        records['decision'] = escalate.cat.codes.to_numpy()
+        # The database stores confidences as text, with 'None' for decisions without one
+        confidence = pd.to_numeric(df['confidence'], errors='coerce')
+        if (confidence.notna() & ((confidence % 1 != 0) | ~confidence.between(0, np.iinfo(np.int8).max))).any():
+            raise ValueError('EventDecision has confidences that are not small integers')
+        records['confidence'] = confidence.fillna(MISSING).to_numpy()
+
+    records['time'] = pd.to_datetime(df[LOGGED[model]]).to_numpy('datetime64[ns]').view(np.int64)
+    return records
+
+
+def _replace(file: Path, text: str):
+    tmp_file = file.with_suffix(f'.{os.getpid()}.tmp')
+    tmp_file.write_text(text, encoding='utf-8')
+    tmp_file.replace(file)
+
+
+def append_tables(log_dir, tables: Dict[type, pd.DataFrame], source: Optional[str] = None) -> Dict[str, int]:
+    """
+    Appends the rows of the given tables that have an id above the log's watermark, creating the log if needed.
+    :param tables: models.py class -> the table as loaded by compute_results.read_table, for models in LOGGED
+    :param source: what the tables were read from, for compute_results.read_table to load the other tables; a log
+        is only ever fed from one source
+    :return: the number of records appended, by table name
+    """
+    log_dir = Path(log_dir)
+    log_dir.mkdir(parents=True, exist_ok=True)
+    if is_log(log_dir):
+        meta = _read_meta(log_dir)
+        if source is not None and meta['source'] not in (None, source):
+            raise ValueError(f'{log_dir} is fed from {meta["source"]}, not {source}')
+    else:
+        meta = {'version': FORMAT_VERSION, 'source': None, 'users': 0, 'tables': {}}
+    meta['source'] = meta['source'] or source
+
+    usernames = _read_users(log_dir, meta['users'])
+    user_codes = {u: i for i, u in enumerate(usernames)}
+    appended = {}
+    for model, df in tables.items():
+        if model not in LOGGED:
+            raise ValueError(f'{model.__name__} is not a logged table')
+        table = meta['tables'].setdefault(model.__name__, {'rows': 0, 'last_id': None})
+        if table['last_id'] is not None:
+            df = df[df['id'] > table['last_id']]
+        records = _encode(model, df, user_codes)
+
+        with open(_table_file(log_dir, model), 'ab') as f:
+            # Drop the tail of an interrupted append
+            f.truncate(table['rows'] * RECORD.itemsize)
+            f.write(records.tobytes())
+        table['rows'] += len(records)
+        if len(df):
+            table['last_id'] = int(df['id'].max())
+        appended[model.__name__] = len(records)
+
+    new_users = list(user_codes)[len(usernames):]
+    if new_users:
+        _replace(log_dir / USERS_FILE, '\n'.join(usernames + new_users))
+    meta['users'] = len(user_codes)
+    _replace(log_dir / META_FILE, json.dumps(meta, indent=2))
+    return appended
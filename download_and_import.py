@@ -1,46 +1,350 @@
+"""
+Captures a Heroku Postgres backup of the Cry Wolf app, stores it and restores it into the local analysis database.
+
+Snapshots are stored content-addressed as snapshots/<sha256>.dump, so a dump that is byte-identical to an earlier one
+is stored once, and snapshots/snapshots.csv logs every download with its time, app and hash. The hash restored last
+into each database is kept in snapshots/restored.json; when a new download has the same hash (and at least the same
+tables were restored) the restore is skipped. Large dumps are restored with parallel pg_restore jobs, and
+--analysis-only restores only the tables the analysis reads.
+
+The heroku, pg_restore and createdb executables can be replaced, e.g., with a local script that writes a fixture
+dump to the path given by --output, through the --heroku, --pg-restore and --createdb flags or the HEROKU_CLI,
+PG_RESTORE and CREATEDB variables. tests/fakes/ has such scripts.
+
+With --apps, several apps are captured and downloaded concurrently with asyncio and each is restored into its own
+database, which is created first if it does not exist, at most --max-restores at a time. Output of every command is
+prefixed with its app, and the wall-clock time of each step (capture, download, store, waiting for a restore slot,
+restore) is reported per app.
+
+Usage: python download_and_import.py [--app cry-wolf] [--database crywolf] [--analysis-only] [--jobs N] [--force]
+       python download_and_import.py --apps APP[:DATABASE] ... [--max-restores N] [--analysis-only] [--force]
+"""
+import argparse
+import asyncio
+import contextlib
+import csv
+import hashlib
+import json
 import os
 import shlex
-import shutil
+import subprocess
+import time
 from datetime import datetime
 from pathlib import Path
-from subprocess import Popen
+from typing import Dict, List, Optional, Sequence
+
+from models import Event, EventClicked, EventDecision, PrequestionnaireAnswer, SurveyAnswer, User
+
+HEROKU_APP = 'cry-wolf'
+SNAPSHOTS_DIR = Path('snapshots')
+PG_USERNAME = 'postgres'
+PG_PASSWORD = 'postgres'
+PG_HOST = 'localhost'
+PG_DATABASE = 'crywolf'
+HEROKU = os.environ.get('HEROKU_CLI', 'heroku')
+PG_RESTORE = os.environ.get('PG_RESTORE', 'pg_restore')
+CREATEDB = os.environ.get('CREATEDB', 'createdb')
+
+# The tables read by compute_results, event_stats and the other analysis scripts
+ANALYSIS_TABLES = [model.__tablename__ for model in
+                   [Event, EventDecision, EventClicked, User, SurveyAnswer, PrequestionnaireAnswer]]
+# Dumps at least this large are restored with parallel jobs
+PARALLEL_RESTORE_BYTES = 64 * 2 ** 20
+MAX_RESTORE_JOBS = 8
+# Restores running at once when several apps are captured together
+MAX_CONCURRENT_RESTORES = 2
+
+
+def _run(command: str, env: dict = None):
+    print(f'$ {command}')
+    subprocess.run(shlex.split(command), env=env, check=True)
+
+
+def file_hash(path: Path) -> str:
+    """
+    :return: the hex SHA-256 of the file, read in chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2 ** 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_snapshot(dump: Path, snapshots_dir: Path, heroku_app: str) -> Path:
+    """
+    Moves a downloaded dump into the content-addressed store, dropping it if an identical snapshot is stored already.
+    :return: the stored snapshot, snapshots_dir/<sha256>.dump
+    """
+    snapshots_dir = Path(snapshots_dir)
+    snapshots_dir.mkdir(parents=True, exist_ok=True)
+    digest = file_hash(dump)
+    snapshot = snapshots_dir / f'{digest}.dump'
+    if snapshot.exists():
+        print(f'Snapshot {digest} is stored already')
+        Path(dump).unlink()
+    else:
+        Path(dump).replace(snapshot)
+
+    index = snapshots_dir / 'snapshots.csv'
+    new_index = not index.exists()
+    with open(index, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if new_index:
+            writer.writerow(['downloaded', 'app', 'sha256', 'bytes'])
+        writer.writerow([datetime.now().isoformat(timespec='seconds'), heroku_app, digest, snapshot.stat().st_size])
+    return snapshot
+
+
+def restore_jobs(snapshot: Path) -> int:
+    """
+    :return: the number of parallel pg_restore jobs for a snapshot: 1 for small dumps, up to MAX_RESTORE_JOBS otherwise
+    """
+    if Path(snapshot).stat().st_size < PARALLEL_RESTORE_BYTES:
+        return 1
+    return max(1, min(os.cpu_count() or 1, MAX_RESTORE_JOBS))
+
+
+def restore_snapshot(snapshot, pg_password, pg_host, pg_username, pg_database, tables: Optional[Sequence[str]] = None,
+                     jobs: int = None, pg_restore: str = PG_RESTORE):
+    """
+    Restores a custom-format dump with pg_restore, dropping the objects it recreates first.
+    :param tables: restore only these tables, by default the whole dump. pg_restore -t restores the tables' definitions
+        and data but not their indexes or constraints.
+    :param jobs: number of parallel pg_restore jobs; by default chosen from the dump's size (see restore_jobs)
+    """
+    _run(*_restore_command(snapshot, pg_password, pg_host, pg_username, pg_database, tables, jobs, pg_restore))
+
+
+def _restore_command(snapshot, pg_password, pg_host, pg_username, pg_database, tables, jobs, pg_restore):
+    """
+    :return: (pg_restore command, its environment) for restore_snapshot
+    """
+    # Postgres reads the password from the environment of the pg_restore process only
+    env = dict(os.environ, PGPASSWORD=pg_password)
+    jobs = jobs or restore_jobs(snapshot)
+    selection = ''.join(f' -t {shlex.quote(table)}' for table in tables or [])
+    return (f"{pg_restore} --verbose --clean --if-exists --no-acl --no-owner --jobs {jobs}{selection} "
+            f"-h {pg_host} -U {pg_username} -d {pg_database} {shlex.quote(str(snapshot))}", env)
+
 
+def _restored_file(snapshots_dir: Path) -> Path:
+    return Path(snapshots_dir) / 'restored.json'
 
-def download_and_import(heroku_app, snapshots_dir, pg_password, pg_host, pg_username, pg_database):
-    # Download the database dump
-    Popen(shlex.split(f"heroku pg:backups:capture -a {heroku_app}")).wait()
-    Popen(shlex.split(f"heroku pg:backups:download -a {heroku_app}")).wait()
 
-    # copy it to snapshots folder and timestamp it
-    if not os.path.exists(snapshots_dir):
-        os.makedirs(snapshots_dir)
-    snapshot = Path(
-        snapshots_dir, f'{heroku_app}_{datetime.now().strftime("%Y%m%d_%H-%M-%S")}.dump')
-    shutil.copy('latest.dump', snapshot)
-    os.remove('latest.dump')
+def last_restored(snapshots_dir: Path, pg_host: str, pg_database: str) -> Optional[dict]:
+    """
+    :return: {'sha256': ..., 'tables': [...] or None for all, 'restored': time} of the snapshot restored last into
+        the database, or None
+    """
+    restored_file = _restored_file(snapshots_dir)
+    if not restored_file.exists():
+        return None
+    return json.loads(restored_file.read_text()).get(f'{pg_host}/{pg_database}')
 
-    # Need to set this so Postgres can log in. Not recommended for security reasons on a server.
-    # Assumes Postgres is running on localhost
-    os.environ["PGPASSWORD"] = pg_password
 
-    # Do the import using the pg_restore tool
-    Popen(shlex.split(
-        f"pg_restore --verbose --clean --no-acl --no-owner -h {pg_host} -U {pg_username} -d {pg_database} {snapshot}")).wait()
+def _record_restore(snapshots_dir: Path, pg_host: str, pg_database: str, digest: str, tables: Optional[List[str]]):
+    restored_file = _restored_file(snapshots_dir)
+    restored = json.loads(restored_file.read_text()) if restored_file.exists() else {}
+    restored[f'{pg_host}/{pg_database}'] = {'sha256': digest, 'tables': tables,
+                                            'restored': datetime.now().isoformat(timespec='seconds')}
+    restored_file.write_text(json.dumps(restored, indent=2))
+
+
+def is_restored(previous: Optional[dict], digest: str, tables: Optional[Sequence[str]]) -> bool:
+    """
+    :return: True if the previous restore (see last_restored) was of the same snapshot and covered the tables
+    """
+    if previous is None or previous['sha256'] != digest:
+        return False
+    return previous['tables'] is None or (tables is not None and set(tables) <= set(previous['tables']))
+
+
+def download_and_import(heroku_app, snapshots_dir, pg_password, pg_host, pg_username, pg_database,
+                        tables: Optional[Sequence[str]] = None, jobs: int = None, force: bool = False,
+                        heroku: str = HEROKU, pg_restore: str = PG_RESTORE) -> Path:
+    """
+    Captures and downloads a new backup of heroku_app, stores it in snapshots_dir and restores it unless the same
+    snapshot is restored in the database already.
+    :param tables: restore only these tables, e.g., ANALYSIS_TABLES; by default the whole dump
+    :param jobs: number of parallel pg_restore jobs; by default chosen from the dump's size
+    :param force: restore even if the snapshot is unchanged
+    :return: the stored snapshot
+    """
+    snapshots_dir = Path(snapshots_dir)
+    snapshots_dir.mkdir(parents=True, exist_ok=True)
+    download = snapshots_dir / 'latest.dump.partial'
+    _run(f"{heroku} pg:backups:capture -a {heroku_app}")
+    _run(f"{heroku} pg:backups:download -a {heroku_app} --output {shlex.quote(str(download))}")
+    snapshot = store_snapshot(download, snapshots_dir, heroku_app)
+
+    digest = snapshot.stem
+    tables = sorted(tables) if tables else None
+    if not force and is_restored(last_restored(snapshots_dir, pg_host, pg_database), digest, tables):
+        print(f'Snapshot {digest} is restored in {pg_database} already, skipping the restore')
+        return snapshot
+    restore_snapshot(snapshot, pg_password, pg_host, pg_username, pg_database, tables, jobs, pg_restore)
+    _record_restore(snapshots_dir, pg_host, pg_database, digest, tables)
 
     print(
         f"Run the following from .venv terminal: sqlacodegen postgresql:///{pg_database} --outfile models.py")
+    return snapshot
+
+
+async def _run_async(command: str, prefix: str, env: dict = None, tolerate: str = None):
+    """
+    Runs a command without blocking the event loop, printing each line of its output prefixed with [prefix].
+    :param tolerate: a failure whose output contains this text is not an error
+    :raise subprocess.CalledProcessError: if the command fails
+    """
+    print(f'[{prefix}] $ {command}')
+    process = await asyncio.create_subprocess_exec(*shlex.split(command), env=env, stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.STDOUT)
+    output = []
+    async for line in process.stdout:
+        output.append(line.decode(errors="replace").rstrip())
+        print(f'[{prefix}] {output[-1]}')
+    if await process.wait() and not (tolerate and any(tolerate in line for line in output)):
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+class _Steps:
+    """
+    Wall-clock seconds of each step of one app's capture, download, store and restore
+    """
+
+    def __init__(self, app: str):
+        self.app = app
+        self.seconds = {}
+
+    @contextlib.contextmanager
+    def step(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = time.perf_counter() - start
+
+
+async def _capture_and_restore(heroku_app, pg_database, snapshots_dir: Path, pg_password, pg_host, pg_username,
+                               tables, jobs, force, heroku, pg_restore, createdb, restores: asyncio.Semaphore,
+                               bookkeeping: asyncio.Lock) -> dict:
+    steps = _Steps(heroku_app)
+    # Every app downloads to its own file; the snapshot store and restore log are updated one app at a time
+    download = snapshots_dir / f'{heroku_app}.dump.partial'
+    with steps.step('capture'):
+        await _run_async(f"{heroku} pg:backups:capture -a {heroku_app}", heroku_app)
+    with steps.step('download'):
+        await _run_async(f"{heroku} pg:backups:download -a {heroku_app} --output {shlex.quote(str(download))}",
+                         heroku_app)
+    with steps.step('store'):
+        async with bookkeeping:
+            snapshot = await asyncio.to_thread(store_snapshot, download, snapshots_dir, heroku_app)
+            previous = last_restored(snapshots_dir, pg_host, pg_database)
+
+    digest = snapshot.stem
+    if not force and is_restored(previous, digest, tables):
+        print(f'[{heroku_app}] Snapshot {digest} is restored in {pg_database} already, skipping the restore')
+    else:
+        command, env = _restore_command(snapshot, pg_password, pg_host, pg_username, pg_database, tables, jobs,
+                                        pg_restore)
+        with steps.step('wait for restore'):
+            await restores.acquire()
+        try:
+            with steps.step('restore'):
+                # pg_restore -d needs the database to exist; --clean then replaces the contents of an existing one
+                await _run_async(f"{createdb} -h {pg_host} -U {pg_username} {pg_database}", heroku_app, env,
+                                 tolerate='already exists')
+                await _run_async(command, heroku_app, env)
+        finally:
+            restores.release()
+        async with bookkeeping:
+            _record_restore(snapshots_dir, pg_host, pg_database, digest, tables)
+    return {'snapshot': snapshot, 'seconds': steps.seconds}
+
+
+async def download_and_import_all(apps: Dict[str, str], snapshots_dir, pg_password, pg_host, pg_username,
+                                  tables: Optional[Sequence[str]] = None, jobs: int = None, force: bool = False,
+                                  max_restores: int = MAX_CONCURRENT_RESTORES, heroku: str = HEROKU,
+                                  pg_restore: str = PG_RESTORE, createdb: str = CREATEDB) -> Dict[str, dict]:
+    """
+    download_and_import for several apps at once: every app is captured and downloaded concurrently and restored into
+    its own database, created if needed, at most max_restores at a time. A failing app does not stop the others.
+    :param apps: Heroku app -> database to restore it into
+    :return: per app, {'snapshot': stored snapshot, 'seconds': {step: wall-clock seconds}} or {'error': exception}
+    """
+    snapshots_dir = Path(snapshots_dir)
+    snapshots_dir.mkdir(parents=True, exist_ok=True)
+    tables = sorted(tables) if tables else None
+    restores, bookkeeping = asyncio.Semaphore(max_restores), asyncio.Lock()
+    outcomes = await asyncio.gather(*[
+        _capture_and_restore(app, database, snapshots_dir, pg_password, pg_host, pg_username, tables, jobs, force,
+                             heroku, pg_restore, createdb, restores, bookkeeping)
+        for app, database in apps.items()], return_exceptions=True)
+    return {app: {'error': o} if isinstance(o, BaseException) else o for app, o in zip(apps, outcomes)}
+
+
+def database_for(heroku_app: str) -> str:
+    """
+    :return: the default database of an app captured with --apps, e.g., cry-wolf-2 -> crywolf_cry_wolf_2
+    """
+    return f"{PG_DATABASE}_{heroku_app.replace('-', '_').lower()}"
 
 
 if __name__ == "__main__":
-    HEROKU_APP = 'cry-wolf'
-    SNAPSHOTS_DIR = 'snapshots'
-    PG_USERNAME = 'postgres'
-    PG_PASSWORD = 'postgres'
-    PG_HOST = 'localhost'
-    PG_DATABASE = 'crywolf'
-    download_and_import(heroku_app='cry-wolf',
-                        snapshots_dir='snapshots',
-                        pg_password='postgres',
-                        pg_host='localhost',
-                        pg_username='postgres',
-                        pg_database='crywolf')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app', default=HEROKU_APP, help='Heroku app to capture')
+    parser.add_argument('--apps', nargs='+', metavar='APP[:DATABASE]',
+                        help='capture several apps concurrently, each into its own database (default: '
+                             f'{database_for("<app>")})')
+    parser.add_argument('--max-restores', type=int, default=MAX_CONCURRENT_RESTORES,
+                        help='restores running at once with --apps')
+    parser.add_argument('--snapshots', type=Path, default=SNAPSHOTS_DIR, help='snapshot store directory')
+    parser.add_argument('--host', default=PG_HOST)
+    parser.add_argument('--username', default=PG_USERNAME)
+    parser.add_argument('--database', default=PG_DATABASE)
+    parser.add_argument('--analysis-only', action='store_true',
+                        help=f'restore only the analysis tables: {", ".join(ANALYSIS_TABLES)}')
+    parser.add_argument('--jobs', type=int, help='parallel pg_restore jobs (default: by dump size)')
+    parser.add_argument('--force', action='store_true', help='restore even if the snapshot is unchanged')
+    parser.add_argument('--heroku', default=HEROKU, help='heroku executable (default: $HEROKU_CLI or heroku)')
+    parser.add_argument('--pg-restore', default=PG_RESTORE,
+                        help='pg_restore executable (default: $PG_RESTORE or pg_restore)')
+    parser.add_argument('--createdb', default=CREATEDB,
+                        help='createdb executable, used with --apps (default: $CREATEDB or createdb)')
+    args = parser.parse_args()
+
+    if args.apps:
+        _apps = dict(a.split(':', 1) if ':' in a else (a, database_for(a)) for a in args.apps)
+        _results = asyncio.run(download_and_import_all(
+            _apps,
+            snapshots_dir=args.snapshots,
+            pg_password=os.environ.get('PGPASSWORD', PG_PASSWORD),
+            pg_host=args.host,
+            pg_username=args.username,
+            tables=ANALYSIS_TABLES if args.analysis_only else None,
+            jobs=args.jobs,
+            force=args.force,
+            max_restores=args.max_restores,
+            heroku=args.heroku,
+            pg_restore=args.pg_restore,
+            createdb=args.createdb))
+        for _app, _result in _results.items():
+            if 'error' in _result:
+                print(f'{_app} -> {_apps[_app]}: failed: {_result["error"]}')
+            else:
+                _steps = ', '.join(f'{step} {seconds:.1f}s' for step, seconds in _result['seconds'].items())
+                print(f'{_app} -> {_apps[_app]}: {_result["snapshot"].stem[:12]} ({_steps})')
+        exit(any('error' in r for r in _results.values()))
+
+    download_and_import(heroku_app=args.app,
+                        snapshots_dir=args.snapshots,
+                        pg_password=os.environ.get('PGPASSWORD', PG_PASSWORD),
+                        pg_host=args.host,
+                        pg_username=args.username,
+                        pg_database=args.database,
+                        tables=ANALYSIS_TABLES if args.analysis_only else None,
+                        jobs=args.jobs,
+                        force=args.force,
+                        heroku=args.heroku,
+                        pg_restore=args.pg_restore)
@@ -1,34 +1,65 @@
+import argparse
 import os
 from datetime import datetime
 from pathlib import Path
 
 from openpyxl import Workbook
-from sqlalchemy import create_engine, desc
+from sqlalchemy import create_engine, select
 from sqlalchemy.orm import sessionmaker
 
+from instrumentation import add_argument, enable_from_args, stage
 from models import (Event, EventClicked, EventDecision, PrequestionnaireAnswer,
                     SurveyAnswer, TrainingEvent, TrainingEventDecision, User)
 
 
-def _to_dict(model):
-    if model is None:
-        return {}
-    d = model.__dict__
-    d.pop('_sa_instance_state', None)   # remove this sqlalchemy state variable
-    return d
+# Rows fetched from the server-side cursor per round trip
+CHUNK_SIZE = 10000
 
+# Every table of the Cry Wolf database, in sheet order
+MODELS = [User,
+          PrequestionnaireAnswer,
+          TrainingEvent,
+          TrainingEventDecision,
+          Event,
+          EventClicked,
+          EventDecision,
+          SurveyAnswer]
 
-def _create_sheet_for_table(session, wb, sheet_name, model):
+
+def _create_sheet_for_table(session, wb, sheet_name, model, chunk_size=CHUNK_SIZE):
+    """
+    Streams a table into a new sheet of a write-only workbook. Rows are read through a server-side cursor
+    chunk_size at a time and appended as plain tuples, so memory use does not grow with the size of the table.
+    """
     ws = wb.create_sheet(sheet_name)
-    results = [_to_dict(d) for d in session.query(model)]
-    headers = list(results[0].keys())
+    columns = list(model.__table__.columns)
+    ws.append([c.name for c in columns])
+
+    query = select(*columns).order_by(*model.__table__.primary_key.columns)
+    with stage(f'dump {model.__name__}') as s:
+        result = session.execute(query, execution_options={'stream_results': True, 'yield_per': chunk_size})
+        rows = 0
+        for chunk in result.partitions():
+            rows += len(chunk)
+            for row in chunk:
+                ws.append(tuple(row))
+        s.rows_out = rows
+
+
+def write_workbook(engine, excel_file):
+    """
+    Writes every table of the Cry Wolf database behind engine to excel_file, one sheet per table.
+    """
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+    wb = Workbook(write_only=True)
+    for m in MODELS:
+        _create_sheet_for_table(session, wb, m.__name__, m)
 
-    for col in range(len(headers)):
-        ws.cell(row=1, column=col+1, value=headers[col])
-    for row in range(2, len(results) + 2):
-        for field in range(len(headers)):
-            ws.cell(row=row, column=field+1,
-                    value=results[row-2].get(headers[field], None))
+    with stage('save workbook'):
+        wb.save(excel_file)
+    session.close()
 
 
 def dump_db_to_excel(excel_dir, filename, pg_username, pg_password, pg_host, pg_database):
@@ -39,28 +70,14 @@ def dump_db_to_excel(excel_dir, filename, pg_username, pg_password, pg_host, pg_
 
     engine = create_engine(
         f'postgresql+psycopg2://{pg_username}:{pg_password}@{pg_host}/{pg_database}')
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
-    wb = Workbook()
-    wb.remove_sheet(wb.active)
-    models = [User,
-              PrequestionnaireAnswer,
-              TrainingEvent,
-              TrainingEventDecision,
-              Event,
-              EventClicked,
-              EventDecision,
-              SurveyAnswer]
-
-    for m in models:
-        _create_sheet_for_table(session, wb, m.__name__, m)
-
-    wb.save(excel_file)
-    session.close()
+    write_workbook(engine, excel_file)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    add_argument(parser)
+    enable_from_args(parser.parse_args())
+
     dump_db_to_excel(excel_dir='excel',
                      filename='cry-wolf',
                      pg_username='postgres',
@@ -0,0 +1,54 @@
+"""
+Feeds a decision_log from a backup workbook, a database or a dump_db_to_columnar export.
+
+The EventDecision and EventClicked tables are read with compute_results.read_table and their rows not yet in the log
+are appended, so rerunning it against a live database only adds the decisions and clicks made since the last run.
+The log is written to LOG_DIR/<source name>/ unless --log is given, and can then be passed as the source of
+compute_results, event_decision_time, event_stats and duplicate_decision.
+
+Usage: python dump_decision_log.py [SOURCE] [--log DIR]
+"""
+import argparse
+from pathlib import Path
+
+from compute_results import is_db_url, read_table
+from decision_log import LOGGED, append_tables
+from instrumentation import add_argument, enable_from_args, stage
+
+LOG_DIR = Path('logs')
+
+
+def default_log_dir(source: str) -> Path:
+    """
+    :return: the log directory of a source; database URLs are named after their database
+    """
+    if is_db_url(source):
+        return LOG_DIR / source.rsplit('/', 1)[-1]
+    return LOG_DIR / Path(source).name
+
+
+def dump_decision_log(source: str, log_dir=None) -> Path:
+    """
+    Appends the new rows of source's logged tables to log_dir, by default default_log_dir(source).
+    :return: the log directory
+    """
+    log_dir = Path(log_dir) if log_dir else default_log_dir(source)
+    tables = {model: read_table(source, model) for model in LOGGED}
+    with stage('append log', rows_in=sum(len(df) for df in tables.values())) as s:
+        appended = append_tables(log_dir, tables, source)
+        s.rows_out = sum(appended.values())
+    for name, count in appended.items():
+        print(f'{name}: appended {count} records')
+    return log_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', nargs='?', default='cry-wolf_20200125_14-35-09_patched',
+                        help='workbook name, database URL or export directory to read')
+    parser.add_argument('--log', type=Path, help='log directory to append to')
+    add_argument(parser)
+    args = parser.parse_args()
+    enable_from_args(args)
+
+    print(dump_decision_log(args.source, args.log))
@@ -1,96 +1,153 @@
 """
 This script produces information on how many event decisions were recorded, including the number of changed decisions.
+
+The EventDecision sheet is streamed once in read-only mode. Only one small record per user and event is kept, so
+memory grows with the number of user/event pairs, not the number of decisions. A decision_log directory can be
+passed instead of a workbook; its decisions are decoded straight from the mapped records.
 """
+import argparse
+import json
 from pathlib import Path
 
+import numpy as np
 import openpyxl
 
+from decision_log import MISSING, DecisionLog, is_log
+from models import EventDecision
+from schema import DECISIONS
+
+UNDECIDED = "I don't know"
+
+
+class EventDecisions:
+    """
+    The decisions one user made on one event. Two decisions are the same when their decision and confidence are
+    equal, so unchanged resubmissions are not counted as distinct.
+    """
+    __slots__ = ('user', 'event_id', 'distinct', 'latest_time', 'latest_decision')
+
+    def __init__(self, user, event_id):
+        self.user = user
+        self.event_id = event_id
+        # (decision, confidence) -> time it was first submitted
+        self.distinct = {}
+        self.latest_time = None
+        self.latest_decision = None
 
-class EventDecision:
-    def __init__(self, _row):
-        self.time = _row[1].value
-        self.decision = _row[2].value
-        self.user = _row[3].value
-        self.confidence = _row[4].value
-        self.event_id = _row[5].value
-        self.decision_id = _row[0].value
+    def add(self, time, decision, confidence):
+        self.distinct.setdefault((decision, confidence), time)
+        if self.latest_time is None or time >= self.latest_time:
+            self.latest_time = time
+            self.latest_decision = decision
 
     def __repr__(self):
-        return f'({self.user},{self.event_id},{self.decision},{self.confidence})'
-
-    def __str__(self):
-        return self.__repr__()
-
-    def __eq__(self, other):
-        """
-        Equality in an EventDecisions is when the user, event_id, decision, and confidence are equal.
-        :param other: the EventDecision to compare to
-        :return: True or False
-        """
-        return self.user == other.user and self.event_id == other.event_id \
-            and self.decision == other.decision and self.confidence == other.confidence
-
-    def __hash__(self):
-        return hash((self.user, self.event_id, self.decision, self.confidence))
-
-    def __lt__(self, value):
-        return self.time < value.time
-
-
-file = Path('backups') / 'cry-wolf_20200125_14-35-09_patched.xlsx'
-wb = openpyxl.load_workbook(file)
-event_sheet = wb['EventDecision']
-
-# users is a dictionary whose key is the username. the Values are a dictionary of eventId : Set(EventDecision).
-users: dict[str: dict[str:set[EventDecision]]] = {}
-resubmit_count = 0  # this will count the total number of resubmissions, including resubmissions that do not change
-event_decision_count = 0
-for row in event_sheet.iter_rows(min_row=2):
-    event_decision_count += 1
-    ed = EventDecision(row)
-
-    if ed.user not in users:
-        users[ed.user] = {ed.event_id: {ed}}
-    else:
-        if ed.event_id in users[ed.user]:
-            # The value here is added to a Set. Thus, equivalent EventDecisions will not be saved.
-            users[ed.user][ed.event_id].add(ed)
-            # This will capture all resubmissions
+        return '[' + ', '.join(f'({self.user},{self.event_id},{decision},{confidence})'
+                               for (decision, confidence), _ in sorted(self.distinct.items(), key=lambda d: d[1])) + ']'
+
+
+def _workbook_rows(file):
+    """
+    :return: (user, event_id, time, decision, confidence) of every decision in the workbook's EventDecision sheet
+    """
+    wb = openpyxl.load_workbook(file, read_only=True)
+    rows = wb['EventDecision'].iter_rows(values_only=True)
+    # Column order differs between exports, so look columns up by name
+    header = next(rows)
+    time_col, decision_col, user_col, confidence_col, event_col = (
+        header.index(c) for c in ('time_event_decision', 'escalate', 'user', 'confidence', 'event_id'))
+    for row in rows:
+        if row[user_col] is None:
+            # Blank rows, e.g., below the data in workbooks annotated with charts
+            continue
+        yield row[user_col], row[event_col], row[time_col], row[decision_col], row[confidence_col]
+    wb.close()
+
+
+def _log_rows(log_dir):
+    """
+    :return: (user, event_id, time, decision, confidence) of every decision in a decision log, decoded to the values
+        a workbook holds
+    """
+    log = DecisionLog(log_dir)
+    records = log.records(EventDecision)
+    decisions = np.array([*DECISIONS.categories, None], dtype=object)
+    confidence = records['confidence']
+    return zip(log.users[records['user']],
+               records['event_id'].tolist(),
+               records['time'].view('datetime64[ns]').astype('datetime64[us]').tolist(),
+               # MISSING indexes the trailing None
+               decisions[records['decision']],
+               np.where(confidence == MISSING, 'None', confidence.astype(str)).tolist())
+
+
+def resubmission_report(file) -> dict:
+    """
+    :param file: path to a workbook with an EventDecision sheet, or to a decision log
+    :return: the report as a dict of counts, plus the distinct decisions of every changed user/event pair in 'changed'
+    """
+    pairs = {}
+    # user -> order of first appearance, to report users in the order they started deciding
+    users = {}
+    decision_count = 0
+    resubmit_count = 0  # this will count the total number of resubmissions, including resubmissions that do not change
+    for user, event_id, time, decision, confidence in (_log_rows(file) if is_log(file) else _workbook_rows(file)):
+        decision_count += 1
+        key = (user, event_id)
+        if key in pairs:
             resubmit_count += 1
         else:
-            users[ed.user][ed.event_id] = {ed}
-
-print(f"Number of unique event decisions: {event_decision_count}")
-print(f"Number of resubmitted event decisions: {resubmit_count}")
-print(f"Number of unique users: {len(users.keys())}")
-
-# Count unique decisions (not unchanged resubmissions) and provide eventdecision changed info
-print("\nUsers+event ids with changes on resubmit:")
-count_changed = 0
-count_changed_events = 0
-change_counts_by_user = {}
-total_i_dont_knows = 0
-total_unique_decisions = 0
-for user, v in users.items():
-    for event_id, decisions in v.items():
-        total_unique_decisions += len(decisions)
+            pairs[key] = EventDecisions(*key)
+            users.setdefault(user, len(users))
+        pairs[key].add(time, decision, confidence)
+
+    changed = sorted((p for p in pairs.values() if len(p.distinct) > 1), key=lambda p: users[p.user])
+    changes_by_user = {}
+    for p in changed:
+        changes_by_user[p.user] = changes_by_user.get(p.user, 0) + 1
+
+    return {
+        'decision_count': decision_count,
+        'resubmit_count': resubmit_count,
+        'user_count': len(users),
+        'unique_decision_count': sum(len(p.distinct) for p in pairs.values()),
         # Count final alarm decisions that were "I don't know"
-        if sorted(list(decisions))[-1].decision == "I don't know":
-            total_i_dont_knows += 1
-
-        # Gather info on which users changed their decisions
-        if len(decisions) > 1:
-            if user in change_counts_by_user:
-                change_counts_by_user[user] += 1
-            else:
-                change_counts_by_user[user] = 1
-            count_changed += len(decisions) - 1
-            count_changed_events += 1
-
-            print(sorted(decisions))
-
-print(f"Total number of unique decisions: {total_unique_decisions}")
-print(f"Total number of final decisions that were \"I don't know\": {total_i_dont_knows}")
-print(f"Number of changes on resubmit: {count_changed}")
-print(f"Number of unique events that were changed: {count_changed_events}")
-print(f"Users who changed their answers: {change_counts_by_user}")
+        'final_i_dont_know_count': sum(p.latest_decision == UNDECIDED for p in pairs.values()),
+        'change_count': sum(len(p.distinct) - 1 for p in changed),
+        'changed_event_count': len(changed),
+        'changes_by_user': changes_by_user,
+        'changed': changed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('file', nargs='?', type=Path,
+                        default=Path('backups') / 'cry-wolf_20200125_14-35-09.xlsx',
+                        help='workbook or decision log directory')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    report = resubmission_report(args.file)
+
+    if args.json:
+        report['changed'] = [{'user': p.user, 'event_id': p.event_id,
+                              'decisions': [{'decision': d, 'confidence': c, 'time': t.isoformat()}
+                                            for (d, c), t in sorted(p.distinct.items(), key=lambda d: d[1])]}
+                             for p in report['changed']]
+        print(json.dumps(report, indent=2))
+        exit(0)
+
+    print(f"Number of unique event decisions: {report['decision_count']}")
+    print(f"Number of resubmitted event decisions: {report['resubmit_count']}")
+    print(f"Number of unique users: {report['user_count']}")
+
+    # Count unique decisions (not unchanged resubmissions) and provide eventdecision changed info
+    print("\nUsers+event ids with changes on resubmit:")
+    for p in report['changed']:
+        print(p)
+
+    print(f"Total number of unique decisions: {report['unique_decision_count']}")
+    print(f"Total number of final decisions that were \"I don't know\": {report['final_i_dont_know_count']}")
+    print(f"Number of changes on resubmit: {report['change_count']}")
+    print(f"Number of unique events that were changed: {report['changed_event_count']}")
+    print(f"Users who changed their answers: {report['changes_by_user']}")
@@ -1,62 +1,42 @@
+import argparse
 from pathlib import Path
 import pandas as pd
 import numpy as np
 
+from compute_results import label_decisions, read_table, summarize_decisions
+from instrumentation import add_argument, enable_from_args, stage
+from item_analysis import analyze_items
+from models import Event, EventDecision
+
+parser = argparse.ArgumentParser()
+# Use the corected master workbook, which correctly labels the 4 eurotrip alerts as TRUE alarms
+# Or the uncorrected 'cry-wolf_20191021_13-51-49_MIS310'
+parser.add_argument('source', nargs='?', default='cry-wolf_20191223_14-13-50_MIS310_corrected',
+                    help='workbook name in backups/, database URL, export or decision log directory')
+add_argument(parser)
+args = parser.parse_args()
+enable_from_args(args)
+
 # Escalate, Don't escalate, I don't know
 def normalize_answer(event):
     if event['should_escalate'] == 1:
         return 'Escalate'
     return "Don't escalate"
 
-# Given an event, return how many participants answered and answered correctly in group1 and group3.
-def calc_difficulty(event, event_decisions):  
-    event['group1_count'] = len(event_decisions[(event_decisions.event_id == event['id']) & (event_decisions.user.str.endswith('1'))])
-    event['group1_correct'] = len(event_decisions[(event_decisions.event_id == event['id']) & (event_decisions.user.str.endswith('1')) & (event_decisions.escalate == event.should_escalate)])         
-
-    event['group3_count'] = len(event_decisions[(event_decisions.event_id == event['id']) & (event_decisions.user.str.endswith('3'))])
-    event['group3_correct'] = len(event_decisions[(event_decisions.event_id == event['id']) & (event_decisions.user.str.endswith('3')) & (event_decisions.escalate == event.should_escalate)])         
-
-    event['group1_difficulty'] = np.NaN if event['group1_count'] == 0 else event['group1_correct'] / event['group1_count']
-    event['group3_difficulty'] = np.NaN if event['group3_count'] == 0 else event['group3_correct'] / event['group3_count']
-    event['total_difficulty'] = np.nansum([event['group1_correct'], event['group3_correct']]) / np.nansum([event['group1_count'], event['group3_count']])    
 
-    print(f"{event['id']}: Group1: {event['group1_correct']}/{event['group1_count']} ({event['group1_difficulty']*100:2.0f}), " \
-          f"Group 3: {event['group3_correct']}/{event['group3_count']} ({event['group3_difficulty']*100:2.0f}), " \
-          f"Total difficulty: {(event['total_difficulty'])*100:2.0f}")
-
-    return event
-
-
-def calc_confusion(user, events, event_decisions): 
-    user_decisions = event_decisions[event_decisions.user == user.user]    
-    for decision in user_decisions.itertuples():
-        answer = events[events.id == decision.event_id].should_escalate.item()
-        # Exclude I don't knows
-        if decision.escalate == "I don't know":
-            user[decision.event_id] = np.NaN
-        elif answer == 'Escalate':
-            user[decision.event_id] = 'TP' if decision.escalate == 'Escalate' else 'FN'
-        else:
-            user[decision.event_id] = 'FP' if decision.escalate == 'Escalate' else 'TN'            
-    return user    
-
-
-# file = Path('backups') / 'cry-wolf_20191021_13-51-49_MIS310.xlsx'
-# Use the corected master workbook, which correctly labels the 4 eurotrip alerts as TRUE alarms
-file = Path('backups') / 'cry-wolf_20191223_14-13-50_MIS310_corrected.xlsx'
-
-
-events = pd.read_excel(file, sheet_name='Event')
-event_decisions = pd.read_excel(file, sheet_name='EventDecision')
+events = read_table(args.source, Event)
+event_decisions = read_table(args.source, EventDecision)
 
 # Drop "check" events from analysis
 events = events[(events['id'] != 74) & (events['id'] != 75)]
 event_decisions = event_decisions[(event_decisions.event_id != 74) & (event_decisions.event_id != 75)]
 
 # Keep only most recent decision per event per user
-event_decisions.sort_values('time_event_decision', inplace=True)
 orig_len = len(event_decisions)
-event_decisions.drop_duplicates(subset=['user', 'event_id'], keep='last', inplace=True)
+with stage('dedup', rows_in=orig_len) as s:
+    event_decisions.sort_values('time_event_decision', inplace=True)
+    event_decisions.drop_duplicates(subset=['user', 'event_id'], keep='last', inplace=True)
+    s.rows_out = len(event_decisions)
 print(f"Dropped {orig_len - len(event_decisions)} duplicate decisions keeping most recent.")
 
 # Normalize 'should_escalate' column and 'event_decision' column values
@@ -68,7 +48,6 @@ print(f"True alarms: {len(true_alarms)}, False alarms: {len(false_alarms)}")
 # Create user dataframe to record users' correctness for each event
 users = pd.DataFrame(event_decisions.user.unique(), columns=['user'])
 event_ids = sorted(list(event_decisions.event_id.unique()))
-users = users.reindex(columns = ['user'] + event_ids)
 # Extract group id
 users['group'] = users.user.str[-1:]
 
@@ -84,12 +63,10 @@ users = users[users.user != 'awiv3']
 # user_info.rename(columns={"username": "user"}, inplace=True)
 # users = pd.merge(users, user_info, how='left', on=['user'])
 
-# Compute confusion matrix for each user, dropping "I don't know" answers
-users = users.apply(calc_confusion, axis=1, args=(events, event_decisions))
-users['TP'] = (users[event_ids] == 'TP').sum(axis=1)
-users['FP'] = (users[event_ids] == 'FP').sum(axis=1)
-users['FN'] = (users[event_ids] == 'FN').sum(axis=1)
-users['TN'] = (users[event_ids] == 'TN').sum(axis=1)
+# Label each decision TP/FP/FN/TN, or IDK for "I don't know"s, which are dropped from the confusion matrix
+labeled = label_decisions(events, event_decisions)
+counts = summarize_decisions(labeled)[['TP', 'FP', 'FN', 'TN']]
+users = users.join(counts, on='user')
 
 # Compute performance measures for each user
 users['sensitivity'] = users['TP'] / (users['TP'] + users['FN'])
@@ -97,42 +74,25 @@ users['specificity'] = users['TN'] / (users['TN'] + users['FP'])
 users['precision'] = users['TP'] / (users['TP'] + users['FP'])
 users['correctness'] = (users['TP'] + users['TN']) / (users['TP'] + users['FP'] + users['TN'] + users['FN'])
 
-# Compute per event difficulty based on user correctness. Difficulty is % of users correct: 0-100.
-event_results = pd.DataFrame([num for num in list(users.columns) if isinstance(num, np.int64)], columns=['id'])
+# Compute per event difficulty (p, the share of users correct) and discrimination index (D) based on user correctness.
+# Treat different false alarm rate groups as different tests as they are, according to performance measures, testing different skills/constructs.
+# D is computed from the 27% highest and lowest performers from the group across all events.
+for group, size in users.groupby('group').size().items():
+    print(f'len group {group}: {size}')
+items = analyze_items(labeled, users)
 
 # Overall difficulty - not using it since we are doing group-level metrics
-# event_results['difficulty'] = [((users[e] == 'TP').sum() + (users[e] == 'TN').sum()) / users[e].notna().sum() for e in event_results['id']]
-
-
-def calc_discrimination_index(event, label, high, low):
-    eid = event['id']
-    if high[eid].isna().all() or low[eid].isna().all():
-        event[label] = np.NaN
-    else:
-        high_correct = len(high[high[eid] == 'TP']) + len(high[high[eid] == 'TN'])
-        low_correct = len(low[low[eid] == 'TP']) + len(low[low[eid] == 'TN'])
-        event[label] = (high_correct - low_correct)/ max([len(high), len(low)])
-    return event
-
-# Calculate discrimination index for each event based on user correctness.
-# Treat different false alarm rate groups as different tests as they are, according to performance measures, testing different skills/constructs.
-for group in ['1', '3']:
-    df = users[users.group == group]
-    print(f'len group {group}: {len(df)}')
-    
-    # Compute difficulty score
-    event_results[f'group{group}_diff'] = [((df[e] == 'TP').sum() + (df[e] == 'TN').sum()) / df[e].notna().sum() for e in event_results['id']]
+# overall = analyze_items(labeled, users.assign(group='all'))
 
-    # Take the 27% highest and lowest performers from the group across all events to calculate the discrimination index
-    df.sort_values(by='correctness', ascending=False, inplace=True)
-    size = round(len(df)*0.27)
-    high = df.head(n=size)
-    low = df.tail(n=size)
-    event_results = event_results.apply(calc_discrimination_index, axis=1, args=(f'group{group}_D', high, low))
+event_results = items[['p', 'D']].unstack('group').reindex(event_ids)
+event_results.columns = [f'group{group}_{"diff" if measure == "p" else measure}' for measure, group in event_results.columns]
+event_results = event_results[['group1_diff', 'group1_D', 'group3_diff', 'group3_D']].rename_axis('id').reset_index()
 
 # Using corrected version, which correctly labels the 4 eurotrip alarms as TRUE alarms
 in_excel = Path('events') / 'events_corrected.xlsx'
-event_types = pd.read_excel(in_excel, sheet_name='event_type')
+with stage('read event_type') as s:
+    event_types = pd.read_excel(in_excel, sheet_name='event_type')
+    s.rows_out = len(event_types)
 headers = [
     'id',
     'true/false alarm',
@@ -0,0 +1,102 @@
+"""
+Batched Mann-Whitney U tests between subsets of participants.
+
+compare_groups ranks each dependent variable once and derives U, the two-sided p-value and the rank-biserial effect
+size for every requested comparison with array operations. Results match scipy.stats.mannwhitneyu with its
+defaults: the normal approximation with tie and continuity corrections, and the exact distribution when one
+sample has 8 or fewer values and there are no ties (those few comparisons are delegated to scipy).
+"""
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.stats as stats
+
+# Largest sample size for which scipy uses the exact distribution of U when there are no ties
+EXACT_MAX_N = 8
+
+
+def _rank_sums(values: np.ndarray, x: np.ndarray, y: np.ndarray):
+    """
+    Ranks values once and computes the rank statistics of every comparison within its own pooled sample.
+    :param values: 1-d array of observations, NaNs allowed
+    :param x: (comparisons, observations) boolean masks of the first sample of each comparison
+    :param y: (comparisons, observations) boolean masks of the second sample of each comparison
+    :return: (rank sum of x, tie correction term, whether any ties, whether any NaN) per comparison
+    """
+    order = np.argsort(values, kind='stable')
+    sorted_values = values[order]
+    x, y = x[:, order], y[:, order]
+    pooled = x | y
+
+    has_nan = (pooled & np.isnan(sorted_values)).any(axis=1)
+
+    # Runs of equal values; a comparison's tie groups are these runs restricted to its pooled sample
+    starts = np.flatnonzero(np.r_[True, sorted_values[1:] != sorted_values[:-1]])
+    tied = np.add.reduceat(pooled, starts, axis=1)
+    x_tied = np.add.reduceat(x, starts, axis=1)
+
+    # Midrank of each run within the pooled sample
+    midrank = np.cumsum(tied, axis=1) - tied + (tied + 1) / 2
+    rank_sum = (x_tied * midrank).sum(axis=1)
+    tie_term = (tied ** 3 - tied).sum(axis=1)
+    return rank_sum, tie_term, (tied > 1).any(axis=1), has_nan
+
+
+def u_test(U1: np.ndarray, n1: np.ndarray, n2: np.ndarray, tie_term: np.ndarray):
+    """
+    Two-sided p-value of the normal approximation, with tie and continuity corrections, and rank-biserial effect size
+    for arrays of U statistics.
+    :param tie_term: sum of t^3 - t over the tie groups of each pooled sample
+    :return: (p, effect)
+    """
+    n = n1 + n2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        U2 = n1 * n2 - U1
+        s = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+        z = (np.maximum(U1, U2) - n1 * n2 / 2 - 0.5) / s
+        p = np.clip(2 * stats.norm.sf(z), 0, 1)
+        effect = 1 - (2 * np.minimum(U1, U2)) / (n1 * n2)
+    return p, effect
+
+
+def compare_groups(df: pd.DataFrame, deps: List[str],
+                   comparisons: Dict[str, Tuple[pd.Series, pd.Series]]) -> pd.DataFrame:
+    """
+    Runs a two-sided Mann-Whitney U test for every dependent variable and comparison.
+    :param df: the source dataframe, e.g., the users dataframe from compute_results
+    :param deps: names of the dependent variable columns to compare
+    :param comparisons: label -> (mask of sample x, mask of sample y), both boolean Series aligned with df
+    :return: a tidy DataFrame with one row per comparison and dependent variable and the columns comparison, dep,
+        n1, n2, mean_x, mean_y, U1, p and effect (rank-biserial correlation, 1 - 2 min(U1, U2) / (n1 n2))
+    """
+    labels = list(comparisons)
+    x = np.array([comparisons[c][0].reindex(df.index, fill_value=False).to_numpy(bool) for c in labels])
+    y = np.array([comparisons[c][1].reindex(df.index, fill_value=False).to_numpy(bool) for c in labels])
+    n1 = x.sum(axis=1)
+    n2 = y.sum(axis=1)
+
+    results = []
+    for dep in deps:
+        values = df[dep].to_numpy(float)
+        rank_sum, tie_term, has_ties, has_nan = _rank_sums(values, x, y)
+
+        U1 = rank_sum - n1 * (n1 + 1) / 2
+        p, effect = u_test(U1, n1, n2, tie_term)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Means skip NaNs, like pandas
+            present = ~np.isnan(values)
+            mean_x = np.where(x & present, values, 0).sum(axis=1) / (x & present).sum(axis=1)
+            mean_y = np.where(y & present, values, 0).sum(axis=1) / (y & present).sum(axis=1)
+
+        # Small samples without ties use the exact distribution of U
+        exact = ((n1 <= EXACT_MAX_N) | (n2 <= EXACT_MAX_N)) & ~has_ties & ~has_nan & (n1 > 0) & (n2 > 0)
+        for i in np.flatnonzero(exact):
+            p[i] = stats.mannwhitneyu(values[x[i]], values[y[i]]).pvalue
+
+        invalid = has_nan | (n1 == 0) | (n2 == 0)
+        U1[invalid] = p[invalid] = effect[invalid] = np.NaN
+
+        results.append(pd.DataFrame({'comparison': labels, 'dep': dep, 'n1': n1, 'n2': n2,
+                                     'mean_x': mean_x, 'mean_y': mean_y, 'U1': U1, 'p': p, 'effect': effect}))
+    return pd.concat(results, ignore_index=True)
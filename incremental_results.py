@@ -0,0 +1,180 @@
+"""
+Incremental per-user metrics for repeated snapshots of a running session.
+
+compute_results reprocesses every decision of a snapshot. This module instead persists, in a state directory:
+- the latest decision of every user on every event, with its outcome (TP, FP, FN, TN or IDK) and confidence
+- per-user tallies: decision count, outcome counts and the sum and count of confidence values
+- a watermark, the highest decision id (or time) applied so far
+
+Applying a snapshot only labels the decisions past the watermark. When one supersedes a user's earlier decision
+on an event, the earlier decision's contribution is subtracted from that user's tallies and the new one added, so
+sensitivity, specificity, precision and correctness follow without touching the rest of the history. With a
+database source only the new rows are fetched.
+
+Usage: python incremental_results.py <workbook name or database URL> [--state DIR] [--reset]
+"""
+import argparse
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+
+from compute_results import (CHECK_EVENT_IDS, EXCLUDED_USERS, FALSE_ALARM, OUTCOMES, TRUE_ALARM, Event, EventDecision,
+                             User, _engine, analyzed_users, is_db_url, label_decisions, read_table)
+from schema import typed
+
+STATE_DIR = Path('state') / 'current'
+
+TALLIES = ['decision_count', 'confidence_sum', 'confidence_n'] + OUTCOMES
+
+
+class IncrementalResults:
+    """
+    Per-user metrics kept up to date by applying only new decisions, see the module docstring.
+    :param watermark_column: 'id' or 'time_event_decision', the EventDecision column that orders new rows after
+        old ones
+    """
+
+    def __init__(self, watermark_column: str = 'id'):
+        self.watermark_column = watermark_column
+        self.watermark = None
+        # Typed like the labeled decisions apply() adds to it, so concatenating them keeps their dtypes
+        self.latest = pd.DataFrame({'time_event_decision': pd.Series(dtype='datetime64[ns]'),
+                                    'id': pd.Series(dtype='int64'),
+                                    'outcome': pd.Series(dtype=object),
+                                    'confidence': pd.Series(dtype=float)},
+                                   index=pd.MultiIndex.from_arrays([[], []], names=['user', 'event_id']))
+        self.tallies = pd.DataFrame(columns=TALLIES, index=pd.Index([], name='user'), dtype=float)
+
+    @classmethod
+    def load(cls, state_dir: Path = STATE_DIR) -> 'IncrementalResults':
+        """
+        :return: the state saved in state_dir, or an empty state if there is none
+        """
+        meta_file = Path(state_dir) / 'state.json'
+        if not meta_file.exists():
+            return cls()
+        meta = json.loads(meta_file.read_text())
+        state = cls(meta['watermark_column'])
+        state.watermark = meta['watermark']
+        if state.watermark is not None and state.watermark_column == 'time_event_decision':
+            state.watermark = pd.Timestamp(state.watermark)
+        state.latest = pd.read_feather(Path(state_dir) / 'latest.feather').set_index(['user', 'event_id'])
+        state.tallies = pd.read_feather(Path(state_dir) / 'tallies.feather').set_index('user')
+        return state
+
+    def save(self, state_dir: Path = STATE_DIR):
+        state_dir = Path(state_dir)
+        state_dir.mkdir(parents=True, exist_ok=True)
+        self.latest.reset_index().to_feather(state_dir / 'latest.feather')
+        self.tallies.reset_index().to_feather(state_dir / 'tallies.feather')
+        watermark = self.watermark.isoformat() if isinstance(self.watermark, pd.Timestamp) else self.watermark
+        (state_dir / 'state.json').write_text(json.dumps({'watermark_column': self.watermark_column,
+                                                          'watermark': watermark}))
+
+    def apply(self, decisions: pd.DataFrame, events: pd.DataFrame) -> int:
+        """
+        Applies the decisions past the watermark.
+        :param decisions: EventDecision rows; rows at or below the watermark are ignored
+        :param events: the Event table, with 'should_escalate' as stored (1 for true alarms)
+        :return: the number of new decision rows
+        """
+        if self.watermark is not None:
+            decisions = decisions[decisions[self.watermark_column] > self.watermark]
+        if decisions.empty:
+            return 0
+        self.watermark = decisions[self.watermark_column].max()
+        if isinstance(self.watermark, np.generic):
+            self.watermark = self.watermark.item()
+        n_new = len(decisions)
+
+        decisions = decisions[~decisions.event_id.isin(CHECK_EVENT_IDS) & ~decisions.user.isin(EXCLUDED_USERS)]
+        decisions = decisions.sort_values(['time_event_decision', 'id']) \
+            .drop_duplicates(subset=['user', 'event_id'], keep='last')
+        # The saved state holds plain usernames and float confidences, whatever dtypes the snapshot was loaded with
+        decisions = decisions.astype({'user': object})
+        decisions['confidence'] = pd.to_numeric(decisions['confidence'], errors='coerce').astype(float)
+        # should_escalate is text in the database and a number in the workbooks
+        events = events.assign(should_escalate=np.where(pd.to_numeric(events.should_escalate, errors='coerce') == 1,
+                                                        TRUE_ALARM, FALSE_ALARM))
+        new = label_decisions(events, decisions) \
+            .set_index(['user', 'event_id'])[['time_event_decision', 'id', 'outcome', 'confidence']]
+
+        # A new decision wins over the stored one for its user and event unless the stored one is more recent
+        old = self.latest.reindex(new.index)
+        stored = old['id'].notna()
+        newer = ~stored | (new.time_event_decision > old.time_event_decision) | \
+            ((new.time_event_decision == old.time_event_decision) & (new['id'] > old['id']))
+        new = new[newer]
+        superseded = old[newer & stored]
+
+        self.tallies = self.tallies \
+            .add(self._tally(new), fill_value=0) \
+            .sub(self._tally(superseded), fill_value=0)
+        self.latest = pd.concat([self.latest.drop(superseded.index), new])
+        return n_new
+
+    @staticmethod
+    def _tally(latest: pd.DataFrame) -> pd.DataFrame:
+        by_user = latest.groupby(level='user')
+        tally = pd.DataFrame({'decision_count': by_user.size(),
+                              'confidence_sum': by_user['confidence'].sum(),
+                              'confidence_n': by_user['confidence'].count()})
+        counts = latest.groupby([latest.index.get_level_values('user'), 'outcome']).size().unstack(fill_value=0)
+        return tally.join(counts).reindex(columns=TALLIES, fill_value=0).fillna(0)
+
+    def metrics(self, users: pd.DataFrame) -> pd.DataFrame:
+        """
+        :param users: the User table of the snapshot
+        :return: one row per user compute_results keeps (see compute_results.analyzed_users), in the same order, with
+            username, group, decision_count, mean confidence, TP/FP/FN/TN/i_dont_knows counts and the performance
+            measures, as in compute_results
+        """
+        tallies = self.tallies.rename(columns={'IDK': 'i_dont_knows'})
+        users = analyzed_users(users)[['username', 'group']].reset_index(drop=True)
+        users['decision_count'] = users['username'].map(tallies['decision_count'])
+        users['confidence'] = users['username'].map(tallies['confidence_sum'] / tallies['confidence_n'])
+        for outcome in OUTCOMES:
+            column = 'i_dont_knows' if outcome == 'IDK' else outcome
+            users[column] = users['username'].map(tallies[column]).fillna(0).astype(int)
+        users['sensitivity'] = users['TP'] / (users['TP'] + users['FN'])
+        users['specificity'] = users['TN'] / (users['TN'] + users['FP'])
+        users['precision'] = users['TP'] / (users['TP'] + users['FP'])
+        users['correctness'] = (users['TP'] + users['TN']) / (users['TP'] + users['FP'] + users['TN'] + users['FN'])
+        return users
+
+
+def update(source: str, state_dir: Path = STATE_DIR) -> pd.DataFrame:
+    """
+    Applies the new decisions of a snapshot to the state in state_dir and saves it.
+    :param source: name of a workbook in backups/ (without .xlsx) or a SQLAlchemy database URL
+    :return: the updated per-user metrics
+    """
+    state = IncrementalResults.load(state_dir)
+    if is_db_url(source) and state.watermark is not None:
+        # Only fetch the rows past the watermark
+        query = select(EventDecision.__table__) \
+            .where(getattr(EventDecision, state.watermark_column) > state.watermark)
+        with _engine(source).connect() as conn:
+            decisions = typed(EventDecision, pd.read_sql(query, conn))
+    else:
+        decisions = read_table(source, EventDecision)
+    n_new = state.apply(decisions, read_table(source, Event))
+    print(f"Applied {n_new} new decisions, watermark {state.watermark_column} = {state.watermark}")
+    state.save(state_dir)
+    return state.metrics(read_table(source, User))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='name of a workbook in backups/ (without .xlsx) or a database URL')
+    parser.add_argument('--state', type=Path, default=STATE_DIR, help=f'state directory, default: {STATE_DIR}')
+    parser.add_argument('--reset', action='store_true', help='discard the saved state and start over')
+    args = parser.parse_args()
+
+    if args.reset and args.state.exists():
+        shutil.rmtree(args.state)
+    print(update(args.source, args.state).to_string(index=False))
@@ -0,0 +1,199 @@
+"""
+Per-stage timing and memory instrumentation for the analysis scripts.
+
+A stage is a block wrapped in `with stage('name', rows_in=len(df)) as s:` that sets `s.rows_out`, or a function
+decorated with @instrumented(). For every stage the run report records:
+- stage: its name, prefixed with the names of the stages it runs in, e.g., 'compute_results/read EventDecision'
+- wall_s and cpu_s: elapsed wall clock and process CPU seconds
+- peak_rss_mib: the highest resident set size while the stage ran. On Linux the high-water mark is reset when a stage
+  starts; elsewhere this is the peak of the process so far.
+- rows_in and rows_out: sizes of the data passed in and produced, where known
+
+Instrumentation is off by default. Then stage() hands out one shared no-op context manager and @instrumented functions
+call straight through, so the scripts run as if uninstrumented. Turn it on by setting the CRYWOLF_PROFILE environment
+variable to the path of the JSON report (or to 1 for profile/<script>_<time>.json), or with the --profile flag of
+compute_results.py, event_stats.py and dump_db_to_excel.py. The report is written when the process exits.
+"""
+import atexit
+import functools
+import json
+import os
+import resource
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+import pandas as pd
+
+ENV_VAR = 'CRYWOLF_PROFILE'
+REPORT_DIR = Path('profile')
+
+# The report being collected, None while disabled
+_report: Optional[dict] = None
+_report_file: Optional[Path] = None
+# Stages currently running, innermost last
+_running: List['_TimedStage'] = []
+
+
+def _rows(value) -> Optional[int]:
+    return len(value) if isinstance(value, (pd.DataFrame, pd.Series)) else None
+
+
+def _peak_rss_mib() -> float:
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def _reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+class _Stage:
+    """
+    The no-op stage handed out while instrumentation is disabled
+    """
+    rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_STAGE = _Stage()
+
+
+class _TimedStage(_Stage):
+    def __init__(self, name: str, rows_in: Optional[int]):
+        self.name = name
+        self.rows_in = rows_in
+        self.peak = 0.0
+
+    def __enter__(self):
+        if _running:
+            # Resetting the high-water mark below would lose the enclosing stage's peak so far
+            _running[-1].peak = max(_running[-1].peak, _peak_rss_mib())
+        _reset_peak_rss()
+        _running.append(self)
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        self.peak = max(self.peak, _peak_rss_mib())
+        _running.pop()
+        _report['_peak'] = max(_report['_peak'], self.peak)
+        if _running:
+            _running[-1].peak = max(_running[-1].peak, self.peak)
+        _report['stages'].append({
+            'stage': '/'.join([s.name for s in _running] + [self.name]),
+            'wall_s': round(wall, 6),
+            'cpu_s': round(cpu, 6),
+            'peak_rss_mib': round(self.peak, 1),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'failed': exc_info[0] is not None,
+        })
+        return False
+
+
+def stage(name: str, rows_in: Optional[int] = None) -> _Stage:
+    """
+    :return: a context manager that records the block it wraps as a stage; set rows_out on it when known
+    """
+    if _report is None:
+        return _NO_STAGE
+    return _TimedStage(name, rows_in)
+
+
+def instrumented(name: str = None):
+    """
+    Decorator recording every call of a function as a stage, named after the function by default. rows_in is the
+    total length of the DataFrame and Series arguments and rows_out the length of a DataFrame or Series result.
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _report is None:
+                return function(*args, **kwargs)
+            sizes = [n for n in map(_rows, [*args, *kwargs.values()]) if n is not None]
+            with _TimedStage(name or function.__name__, sum(sizes) if sizes else None) as s:
+                result = function(*args, **kwargs)
+                s.rows_out = _rows(result)
+            return result
+        return wrapper
+    return decorate
+
+
+def enabled() -> bool:
+    return _report is not None
+
+
+def enable(report_file=None):
+    """
+    Starts collecting stages; the report is written to report_file when the process exits.
+    :param report_file: path of the JSON report; defaults to profile/<script>_<time>.json
+    """
+    global _report, _report_file
+    if _report is not None:
+        return
+    started = datetime.now()
+    if not report_file or report_file == '1':
+        report_file = REPORT_DIR / f'{Path(sys.argv[0]).stem or "python"}_{started.strftime("%Y%m%d_%H-%M-%S")}.json'
+    _report_file = Path(report_file)
+    _report = {'script': sys.argv[0], 'argv': sys.argv[1:], 'started': started.isoformat(), 'pid': os.getpid(),
+               'stages': []}
+    _report['_wall'] = time.perf_counter()
+    # Peak RSS over all stages, as resetting the high-water mark per stage loses the process peak
+    _report['_peak'] = 0.0
+    atexit.register(write_report)
+
+
+def write_report():
+    """
+    Writes the stages recorded so far, plus the run's total wall and CPU seconds and peak RSS, to the report file
+    """
+    if _report is None or os.getpid() != _report['pid']:
+        # Forked workers inherit the report; only the process that enabled it writes it
+        return
+    report = {k: v for k, v in _report.items() if not k.startswith('_')}
+    report['wall_s'] = round(time.perf_counter() - _report['_wall'], 6)
+    report['cpu_s'] = round(time.process_time(), 6)
+    report['peak_rss_mib'] = round(max(_report['_peak'], _peak_rss_mib()), 1)
+    _report_file.parent.mkdir(parents=True, exist_ok=True)
+    _report_file.write_text(json.dumps(report, indent=2))
+    print(f'Wrote run report to {_report_file}', file=sys.stderr)
+
+
+def add_argument(parser):
+    """
+    Adds the --profile [FILE] flag to an argparse parser; pass the parsed arguments to enable_from_args
+    """
+    parser.add_argument('--profile', nargs='?', const='1', metavar='FILE',
+                        help=f'write a per-stage timing and memory report (default file: {REPORT_DIR}/)')
+
+
+def enable_from_args(args):
+    if args.profile:
+        enable(args.profile)
+
+
+if os.environ.get(ENV_VAR):
+    enable(os.environ[ENV_VAR])
@@ -0,0 +1,60 @@
+"""
+Classical test theory item analysis of the Cry Wolf events.
+
+Each event is treated as a test item and each false alarm rate (FAR) group as a separate test. For every group and
+event this computes, with a handful of grouped aggregations over the labeled decisions:
+- count: number of users who answered the event, excluding "I don't know"s
+- correct: number of those answers that were TP or TN
+- p: the difficulty index, correct / count
+- D: the discrimination index, (correct in the top tail - correct in the bottom tail) / tail size, where the tails
+  are the users with the highest and lowest overall correctness in the group
+"""
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented
+
+# Share of a group's users that forms the high and the low scoring tail for the discrimination index
+TAIL = 0.27
+
+
+@instrumented()
+def analyze_items(labeled: pd.DataFrame, users: pd.DataFrame, group_col: str = 'group',
+                  score_col: str = 'correctness', tail: float = TAIL) -> pd.DataFrame:
+    """
+    :param labeled: one row per user per event with 'user', 'event_id' and 'outcome' columns, e.g., from
+        compute_results.label_decisions. Users missing from users are ignored.
+    :param users: one row per user with 'user', group_col and score_col columns
+    :param group_col: column of users to split the analysis by
+    :param score_col: column of users to rank by when choosing the high and low tails
+    :param tail: share of each group in the high and the low tail
+    :return: a DataFrame indexed by (group, event_id) with count, correct, p and D columns
+    """
+    # Rank users within their group, best first, and tag the top and bottom tails. Each group is sorted on its own
+    # so ties at a tail boundary break the same way as when the groups were analyzed one at a time.
+    users = users[['user', group_col, score_col]]
+    ranked = pd.concat([df.sort_values(by=score_col, ascending=False) for _, df in users.groupby(group_col)])
+    by_group = ranked.groupby(group_col)
+    position = by_group.cumcount()
+    group_size = by_group[score_col].transform('size')
+    tail_size = (group_size * tail).round().astype(int)
+    ranked['tier'] = np.select([position < tail_size, position >= group_size - tail_size], ['high', 'low'], default='')
+    ranked['tail_size'] = tail_size
+
+    answered = labeled.loc[labeled.outcome != 'IDK', ['user', 'event_id', 'outcome']] \
+        .merge(ranked[['user', group_col, 'tier', 'tail_size']], on='user')
+    answered['correct'] = answered.outcome.isin(['TP', 'TN'])
+
+    items = answered.groupby([group_col, 'event_id']).agg(count=('correct', 'size'), correct=('correct', 'sum'))
+    items['p'] = items['correct'] / items['count']
+
+    # Discrimination is undefined when nobody in either tail answered the event
+    tails = answered[answered.tier != ''] \
+        .groupby([group_col, 'event_id', 'tier']) \
+        .agg(correct=('correct', 'sum'), tail_size=('tail_size', 'first')) \
+        .unstack('tier')
+    if 'high' in tails['correct'] and 'low' in tails['correct']:
+        items['D'] = (tails['correct', 'high'] - tails['correct', 'low']) / tails['tail_size'].max(axis=1)
+    else:
+        items['D'] = np.NaN
+    return items
@@ -1,46 +1,152 @@
+"""
+Renders the LaTeX tables of the paper from the users results compute_results saved to the results_store.
+
+All summary statistics are computed together by aggregate(): the mean, median, population standard deviation, min
+and max of every outcome for each FAR group and each experience group, in one groupby over both groupings, and
+the participant counts of the crosstabs. As in the paper, the fastest 25% of participants are left out of everything
+but the 'percentile_counts' table. The aggregates are memoized in CACHE_DIR under a fingerprint of the input and
+STATS_VERSION, so re-rendering tables after a formatting change does not recompute them.
+
+Usage: python latex.py [TABLE ...] [--session SESSION] [--out DIR] [--force]
+renders the given tables, or all of TABLES, to DIR/<table>.tex.
+"""
+import argparse
+import hashlib
+import os
 from pathlib import Path
+from typing import Callable, Dict, NamedTuple
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from results_store import load_users
+from workbook_cache import CACHE_DIR
+
+SESSION = 'cry-wolf_20200125_14-35-09_patched'
+TABLE_DIR = Path('tables')
+MEMO_DIR = CACHE_DIR / 'latex'
+# Bump after changing how aggregate() computes the statistics
+STATS_VERSION = 2
+
+GROUPS = {1: r'50\% FAR', 3: r'86\% FAR'}
+OUTCOMES = ['time on task', 'sensitivity', 'specificity', 'precision', 'correctness']
+STATS = ['mean', 'median', r'$\sigma$', 'min', 'max']
+
+
+def _prepare(users: pd.DataFrame) -> pd.DataFrame:
+    df = users.rename(columns={'time_on_task': 'time on task'})
+    df['group'] = df['group'].map(GROUPS)
+    df['time on task percentile'] = df['25th percentile'].map({True: r'25th\%', False: 'Others'})
+    return df
+
+
+def fingerprint(users: pd.DataFrame) -> str:
+    """
+    :return: SHA-256 of the users results and STATS_VERSION
+    """
+    sha = hashlib.sha256(repr((STATS_VERSION, list(users.columns))).encode())
+    sha.update(pd.util.hash_pandas_object(users, index=False).to_numpy().tobytes())
+    return sha.hexdigest()
+
+
+def _aggregate(users: pd.DataFrame) -> pd.DataFrame:
+    df = _prepare(users)
+    counts = [df.groupby(['group', 'time on task percentile']).size().rename('value').reset_index()
+              .rename(columns={'time on task percentile': 'column'}).assign(table='percentile_counts')]
+    df = df[df['time on task percentile'] == 'Others']
+    counts.append(df.groupby(['group', 'experience_group']).size().rename('value').reset_index()
+                  .rename(columns={'group': 'column', 'experience_group': 'group'}).assign(table='experience_counts'))
+
+    # Both groupings stacked, so one groupby computes every statistic with pandas' built-in aggregations
+    measures = df[OUTCOMES + ['confidence']]
+    stacked = pd.concat([measures.assign(grouping='group', level=df['group']),
+                         measures.assign(grouping='experience_group', level=df['experience_group'])],
+                        ignore_index=True)
+    grouped = stacked.groupby(['grouping', 'level'], sort=True)
+    stats = pd.concat({'mean': grouped.mean(), 'median': grouped.median(), r'$\sigma$': grouped.std(ddof=0),
+                       'min': grouped.min(), 'max': grouped.max()}, names=['stat'])
+    stats = stats.rename_axis(columns='measure').stack().rename('value').reset_index()
+    return pd.concat([*counts, stats.rename(columns={'grouping': 'table', 'level': 'column', 'measure': 'group'})],
+                     ignore_index=True)[['table', 'group', 'stat', 'column', 'value']]
+
+
+def aggregate(users: pd.DataFrame, force: bool = False) -> pd.DataFrame:
+    """
+    :param users: users results with the columns of load_users
+    :param force: recompute even if the aggregates of this input are memoized
+    :return: every statistic the tables use, one row each, with the columns table ('group', 'experience_group',
+        'percentile_counts' or 'experience_counts'), group (the measure, or the row of a count), stat (None for
+        counts), column (the FAR or experience group) and value
+    """
+    memo_file = MEMO_DIR / f'{fingerprint(users)}.feather'
+    if memo_file.exists() and not force:
+        return feather.read_feather(memo_file)
+    aggregates = _aggregate(users)
+    memo_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = memo_file.with_suffix(f'.{os.getpid()}.tmp')
+    feather.write_feather(pa.Table.from_pandas(aggregates.astype({'stat': object}), preserve_index=False), tmp_file)
+    tmp_file.replace(memo_file)
+    return aggregates
+
+
+def _counts(aggregates: pd.DataFrame, table: str) -> pd.DataFrame:
+    counts = aggregates[aggregates['table'] == table]
+    return counts.pivot(index='group', columns='column', values='value').rename_axis(index=None, columns=None)
 
-input_file = Path('excel') / "cry-wolf_20200125_14-35-09_patched_analysis.xlsx"
-df = pd.read_excel(input_file, sheet_name='users')
 
-# Generate latex outputs
-df.rename(columns={'time_on_task': 'time on task'}, inplace=True)
-df['group'] = df['group'].replace(to_replace=1, value='50\% FAR')
-df['group'] = df['group'].replace(to_replace=3, value='86\% FAR')
+def _stats(aggregates: pd.DataFrame, table: str, measures) -> pd.DataFrame:
+    stats = aggregates[(aggregates['table'] == table) & aggregates['group'].isin(measures)]
+    stats = stats.pivot(index=['group', 'stat'], columns='column', values='value')
+    return stats.reindex(pd.MultiIndex.from_product([measures, STATS])).rename_axis(columns=None)
 
-df['time on task percentile'] = df['25th percentile'].astype({'25th percentile': 'str'}).map(
-    {'True': '25th%', 'False': 'Others'})
 
-print(df.groupby(['group', 'time on task percentile']).size())
-df = df[df['time on task percentile'] == 'Others']
+class Table(NamedTuple):
+    """
+    One table of the paper: build(aggregates) returns its DataFrame, which is rendered with to_latex(**kwargs)
+    """
+    build: Callable[[pd.DataFrame], pd.DataFrame]
+    kwargs: dict
 
-# confidence
-print(df[['group', 'confidence']].groupby(['group']).agg(['mean', 'median']))
 
-outcomes = ['time on task', 'sensitivity', 'specificity', 'precision', 'correctness']
+TABLES: Dict[str, Table] = {
+    'percentile_counts': Table(lambda a: _counts(a, 'percentile_counts'), dict(na_rep='0', float_format='%.0f')),
+    'confidence': Table(lambda a: _stats(a, 'group', ['confidence']).loc['confidence'].loc[['mean', 'median']],
+                        dict(float_format='%.2f')),
+    'group_stats': Table(lambda a: _stats(a, 'group', OUTCOMES), dict(float_format='%.2f')),
+    'experience_counts': Table(lambda a: _counts(a, 'experience_counts'), dict(na_rep='0', float_format='%.0f')),
+    'experience_stats': Table(lambda a: _stats(a, 'experience_group', OUTCOMES),
+                              dict(na_rep='0', float_format='%.1f')),
+}
 
-# means = df[outcomes].mean()
-# medians = df[outcomes].median()
-# stds = df[outcomes].std(ddof=0)
-# mins = df[outcomes].min()
-# maxes = df[outcomes].max()
-# stats = pd.concat([means, medians, stds, mins, maxes], axis=1)
-# stats.columns = ['mean', 'median', '$\sigma$', 'min', 'max']
-# print(stats.to_latex(float_format='%.2f', escape=False))
 
-group_stats = df[outcomes + ['group']].groupby('group').agg(['mean', 'median', lambda x: x.std(ddof=0), 'min', 'max'])
-group_stats.rename(columns={'<lambda_0>': '$\sigma$'}, inplace=True)
-group_stats = group_stats.transpose()
-# print(group_stats.to_latex(float_format='%.2f', escape=False))
+def render(aggregates: pd.DataFrame, names, out_dir: Path = TABLE_DIR) -> Dict[str, Path]:
+    """
+    Writes the named tables to out_dir/<name>.tex.
+    :return: the files written, by table name
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    files = {}
+    for name in names:
+        table = TABLES[name]
+        files[name] = out_dir / f'{name}.tex'
+        files[name].write_text(table.build(aggregates).to_latex(escape=False, **table.kwargs))
+    return files
 
-# Experience GRoups
-# counts
-print(df.groupby(['group', 'experience_group']).size().unstack().transpose().to_latex(na_rep='0', float_format='%.0f', escape=False))
-#stats
-exp_group_stats = df[outcomes + ['experience_group']].groupby('experience_group').agg(['mean', 'median', lambda x: x.std(ddof=0), 'min', 'max'])
-exp_group_stats.rename(columns={'<lambda_0>': '$\sigma$'}, inplace=True)
-exp_group_stats = exp_group_stats.transpose()
-print(exp_group_stats.to_latex(na_rep='0', float_format='%.1f', escape=False))
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('tables', nargs='*', metavar='TABLE',
+                        help=f'tables to render, default: all of {", ".join(TABLES)}')
+    parser.add_argument('--session', default=SESSION, help='session in the results store')
+    parser.add_argument('--out', type=Path, default=TABLE_DIR, help='directory of the .tex files')
+    parser.add_argument('--force', action='store_true', help='recompute the statistics even if they are memoized')
+    args = parser.parse_args()
+    _unknown = set(args.tables) - set(TABLES)
+    if _unknown:
+        parser.error(f'unknown tables {", ".join(sorted(_unknown))}')
 
+    _users = load_users(args.session, ['group', '25th percentile', 'confidence', 'time_on_task', 'sensitivity',
+                                       'specificity', 'precision', 'correctness', 'experience_group'])
+    for _name, _file in render(aggregate(_users, args.force), args.tables or list(TABLES), args.out).items():
+        print(f'{_name}: {_file}')
@@ -0,0 +1,124 @@
+"""
+Declarative corrections to the Cry Wolf tables, applied in memory when a table is loaded.
+
+The corrections for a workbook in backups/ live in PATCH_DIR/<workbook name>.csv, one row per corrected cell:
+version, table (the models.py class name), key (the row's primary key), column, value and an optional note. Values
+are written as text, like the database stores them, and get their compact dtype from schema.typed afterwards.
+
+The workbook itself is never rewritten. Loading '<workbook name>_patched' through compute_results.read_table reads
+the original workbook and applies all of its corrections; '<workbook name>_patched_v<N>' applies only those up to
+version N, and the plain workbook name applies none. Patched and unpatched analyses so share one source file, and its
+workbook_cache entries.
+
+Usage: python patches.py <workbook name> <table> <key> <column> <value> [--note NOTE]
+records a correction under a new version.
+"""
+import argparse
+import re
+from pathlib import Path
+from typing import Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import Integer
+
+PATCH_DIR = Path('patches')
+COLUMNS = ['version', 'table', 'key', 'column', 'value', 'note']
+
+_PATCHED = re.compile(r'^(?P<source>.+)_patched(?:_v(?P<version>\d+))?$')
+
+
+def patch_file(name: str) -> Path:
+    """
+    :return: the patch file of the workbook backups/<name>.xlsx
+    """
+    return PATCH_DIR / f'{name}.csv'
+
+
+def load_patches(name: str, version: Optional[int] = None) -> pd.DataFrame:
+    """
+    :param name: name of a workbook in backups/ (without .xlsx)
+    :param version: apply only corrections up to this version; None for all of them
+    :return: the workbook's corrections, in the order they were recorded; empty if it has none
+    """
+    file = patch_file(name)
+    if not file.exists():
+        return pd.DataFrame(columns=COLUMNS)
+    patches = pd.read_csv(file, dtype=str, keep_default_na=False)
+    patches['version'] = patches['version'].astype(int)
+    if version is not None:
+        patches = patches[patches['version'] <= version]
+    return patches
+
+
+def resolve(source: str) -> Tuple[str, pd.DataFrame]:
+    """
+    Splits a source such as 'cry-wolf_20200125_14-35-09_patched_v1' into the workbook to read and its corrections.
+    :return: (workbook name, corrections to apply); sources without a patch file are returned unchanged, uncorrected
+    """
+    match = _PATCHED.match(source)
+    if match is None or not patch_file(match['source']).exists():
+        return source, load_patches(source).iloc[:0]
+    version = match['version']
+    return match['source'], load_patches(match['source'], int(version) if version else None)
+
+
+def _keys(model, key: str, values: pd.Series) -> pd.Series:
+    """
+    :return: values as the type of the table's primary key, so that, e.g., a key written as 8.0 matches 8; NaN where a
+        value is not a valid key
+    """
+    if isinstance(model.__table__.c[key].type, Integer):
+        numbers = pd.to_numeric(values, errors='coerce')
+        return numbers.where(numbers % 1 == 0).astype('Int64')
+    return values.astype('string')
+
+
+def apply_patches(model, df: pd.DataFrame, patches: pd.DataFrame) -> pd.DataFrame:
+    """
+    Sets every corrected cell of a table in one vectorized update per column. Later versions win over earlier ones.
+    :param model: the models.py class of the table
+    :param df: the table as loaded, before schema.typed
+    :param patches: corrections as returned by load_patches or resolve
+    :return: df, or a corrected copy if any correction applies to this table
+    :raise KeyError: if a correction names a column or a row the table does not have
+    """
+    patches = patches[patches['table'] == model.__name__]
+    if patches.empty:
+        return df
+    key = model.__table__.primary_key.columns.values()[0].name
+    unknown = set(patches['column']) - set(df.columns)
+    if unknown:
+        raise KeyError(f'Patch for {model.__name__} names unknown columns {sorted(unknown)}')
+
+    keys = _keys(model, key, df[key])
+    patch_keys = _keys(model, key, patches['key'])
+    missing = patch_keys.isna() | ~patch_keys.isin(keys.dropna())
+    if missing.any():
+        raise KeyError(f'Patch for {model.__name__} names unknown {key}s {list(patches.loc[missing, "key"])}')
+    patches = patches.assign(key=patch_keys)
+
+    df = df.copy()
+    patches = patches.sort_values('version', kind='stable')
+    for column, updates in patches.groupby('column', sort=False):
+        values = updates.drop_duplicates('key', keep='last').set_index('key')['value']
+        corrected = keys.map(values)
+        df[column] = df[column].where(corrected.isna(), corrected)
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('name', help='name of a workbook in backups/ (without .xlsx)')
+    parser.add_argument('table', help='models.py class name, e.g., Event')
+    parser.add_argument('key', help="primary key of the row to correct")
+    parser.add_argument('column')
+    parser.add_argument('value')
+    parser.add_argument('--note', default='')
+    args = parser.parse_args()
+
+    _patches = load_patches(args.name)
+    _version = int(_patches['version'].max()) + 1 if len(_patches) else 1
+    _row = pd.DataFrame([[_version, args.table, args.key, args.column, args.value, args.note]], columns=COLUMNS)
+    PATCH_DIR.mkdir(exist_ok=True)
+    pd.concat([_patches, _row]).to_csv(patch_file(args.name), index=False)
+    print(f'{patch_file(args.name)}: version {_version}')
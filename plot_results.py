@@ -3,16 +3,32 @@ Plotting functions for the 'users' and 'decision_time' dataframes from compute_r
 
 The plotting functions can be invoked directly from compute_results.py's __main__ function.
 
-Running this module stand-alone will load the 'users' and 'decision_time' dataframes
-from the Excel files outputted by compute_results.py.
+Running this module stand-alone will load the columns the figures need of the 'users' and 'decision_time' results
+that compute_results.py saved to the results_store.
+
+Figures are rendered headless on the Agg backend and saved to PLOT_DIR; nothing is shown on screen. Each figure is
+described by a Plot: the drawing function, the columns it plots and its parameters. The SHA-256 of these is stored in
+the PNG's metadata, and figures whose PNG already carries the current fingerprint are skipped. The rest are rendered
+in a process pool, so regenerating the figures after a small data fix only redraws the ones it affects.
 """
 
+import argparse
+import hashlib
 import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Callable, List, NamedTuple
+
+import matplotlib
+
+matplotlib.use('Agg')
 
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
+from PIL import Image
+
+from results_store import load_decision_time, load_users
 
 sns.set_palette("pastel")
 sns.set(font_scale=1.5)
@@ -23,19 +39,79 @@ PLOT_DIR = Path('plots')
 if not os.path.exists(PLOT_DIR):
     os.makedirs(PLOT_DIR)
 
+# Columns of the users results the figures plot
+USER_MEASURES = ['sensitivity', 'specificity', 'precision', 'time_on_task']
+
+# Bump to redraw every figure after changing how figures are drawn
+STYLE_VERSION = 1
+FINGERPRINT_KEY = 'Fingerprint'
+
+
+class Plot(NamedTuple):
+    """
+    One figure: draw(data, **kwargs) draws it on the current axes, and it is saved as PLOT_DIR / file
+    """
+    draw: Callable
+    data: pd.DataFrame
+    kwargs: dict
+    file: str
+
 
-def _boxplot(df: pd.DataFrame, x: str, y: str, title: str = None, title_suffix: str = '', file_suffix: str = '',
-             **kwargs) -> None:
+def fingerprint(plot: Plot) -> str:
+    """
+    :return: SHA-256 of the plot's drawing function, parameters and data
     """
-    Utility function for creating grouped box-and-whisker plots. Plots are
-    saved to PLOT_DIR with an automatically-generated filename in PNG format.
+    sha = hashlib.sha256()
+    sha.update(repr((STYLE_VERSION, plot.draw.__name__, sorted(plot.kwargs.items()), list(plot.data.columns),
+                     [str(t) for t in plot.data.dtypes])).encode())
+    sha.update(pd.util.hash_pandas_object(plot.data, index=True).to_numpy().tobytes())
+    return sha.hexdigest()
+
+
+def _is_current(plot: Plot, digest: str) -> bool:
+    try:
+        with Image.open(PLOT_DIR / plot.file) as png:
+            return png.text.get(FINGERPRINT_KEY) == digest
+    except (OSError, AttributeError):
+        return False
+
+
+def _render(plot: Plot, digest: str) -> str:
+    fig = plt.figure()
+    try:
+        plot.draw(plot.data, **plot.kwargs)
+        plt.tight_layout()
+        fig.savefig(PLOT_DIR / plot.file, metadata={FINGERPRINT_KEY: digest})
+    finally:
+        plt.close(fig)
+    return plot.file
+
+
+def render(plots: List[Plot], workers: int = None, force: bool = False) -> List[str]:
+    """
+    Renders the plots whose PNG is missing or out of date.
+    :param workers: number of worker processes; None uses every CPU and 1 renders in this process
+    :param force: render every plot, even if its PNG is current
+    :return: the files rendered
+    """
+    digests = [fingerprint(p) for p in plots]
+    stale = [(p, d) for p, d in zip(plots, digests) if force or not _is_current(p, d)]
+    workers = min(workers or os.cpu_count(), len(stale))
+    if workers <= 1:
+        return [_render(p, d) for p, d in stale]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_render, *zip(*stale)))
+
+
+def _boxplot(df: pd.DataFrame, x: str, y: str, title: str = None, title_suffix: str = '', **kwargs) -> None:
+    """
+    Utility function for creating grouped box-and-whisker plots on the current figure.
 
     :param df: the source dataframe
     :param x: name of the column with groups
     :param y: name of the column to plot
     :param title: optional plot title, e.g., "Sensitivity"
     :param title_suffix: optional title suffix, e.g., "25th percentile removed"
-    :param file_suffix: optional filename suffix, e.g., "25th percentile removed"
     :param kwargs: passthrough to seanborn plotting
     :return: None
     """
@@ -47,65 +123,94 @@ def _boxplot(df: pd.DataFrame, x: str, y: str, title: str = None, title_suffix:
     # Suppress figure title for APA7
     # ax.set_title(title + title_suffix)
     ax.set(**kwargs)
-    plt.tight_layout()
-    plt.savefig(PLOT_DIR / (x.replace(' ', '_') + '-' + y.replace(' ', '_') + file_suffix + ".png"))
-    plt.show()
 
 
-def plot_user_results(df):
+def _boxplot_spec(df: pd.DataFrame, x: str, y: str, file_suffix: str = '', **kwargs) -> Plot:
+    """
+    A _boxplot of columns x and y of df, saved with an automatically-generated filename in PNG format.
+
+    :param file_suffix: optional filename suffix, e.g., "25th percentile removed"
+    :param kwargs: passthrough to _boxplot
+    """
+    return Plot(_boxplot, df[[x, y]], dict(x=x, y=y, **kwargs),
+                x.replace(' ', '_') + '-' + y.replace(' ', '_') + file_suffix + ".png")
+
+
+def user_plots(df: pd.DataFrame) -> List[Plot]:
+    df = df.copy()
     df['group'] = df['group'].astype({'group': 'str'}).map({'1': '50% FAR', '3': '86% FAR'})
     df['time on task percentile'] = df['25th percentile'].astype({'25th percentile': 'str'}).map(
         {'True': '25th%', 'False': 'Others'})
     max_time = max(df['time_on_task'])
 
     # Performance measures - whole group
-    _boxplot(df, x="group", y="sensitivity", ylim=(-0.05, 1.05), xlabel='', ylabel='Sensitivity')
-    _boxplot(df, x="group", y="specificity", ylim=(-0.05, 1.05), xlabel='', ylabel='Specificity')
-    _boxplot(df, x="group", y="precision", ylim=(-0.05, 1.05), xlabel = '', ylabel='Precision')
-    _boxplot(df, x="group", y="time_on_task", ylim=(-0.05, max_time + 1), xlabel='', ylabel="Total Time on Task (m)")
+    plots = [
+        _boxplot_spec(df, x="group", y="sensitivity", ylim=(-0.05, 1.05), xlabel='', ylabel='Sensitivity'),
+        _boxplot_spec(df, x="group", y="specificity", ylim=(-0.05, 1.05), xlabel='', ylabel='Specificity'),
+        _boxplot_spec(df, x="group", y="precision", ylim=(-0.05, 1.05), xlabel='', ylabel='Precision'),
+        _boxplot_spec(df, x="group", y="time_on_task", ylim=(-0.05, max_time + 1), xlabel='',
+                      ylabel="Total Time on Task (m)"),
+    ]
 
     # Performance measures - 25% vs rest
-    # _boxplot(df, x='time on task percentile', y="sensitivity", ylim=(-0.05, 1.05), title_suffix='Time on Task effects')
-    # _boxplot(df, x='time on task percentile', y="specificity", ylim=(-0.05, 1.05), title_suffix='Time on Task effects')
-    # _boxplot(df, x='time on task percentile', y="precision", ylim=(-0.05, 1.05), title_suffix='Time on Task effects')
-    # _boxplot(df, x='time on task percentile', y="time_on_task", ylim=(-0.05, max_time + 1),
-    #          title='Time on Task (Minutes)')
+    # _boxplot_spec(df, x='time on task percentile', y="sensitivity", ylim=(-0.05, 1.05),
+    #               title_suffix='Time on Task effects')
+    # _boxplot_spec(df, x='time on task percentile', y="specificity", ylim=(-0.05, 1.05),
+    #               title_suffix='Time on Task effects')
+    # _boxplot_spec(df, x='time on task percentile', y="precision", ylim=(-0.05, 1.05),
+    #               title_suffix='Time on Task effects')
+    # _boxplot_spec(df, x='time on task percentile', y="time_on_task", ylim=(-0.05, max_time + 1),
+    #               title='Time on Task (Minutes)')
 
     # Perf measure - 25% removed
     # print(df.groupby(['group', 'time on task percentile']).size())
     # df = df[df['time on task percentile'] == 'Others']
     #
-    # _boxplot(df, x="group", y="sensitivity", ylim=(-0.05, 1.05), title_suffix='25th% removed',
-    #          file_suffix='_25th_removed')
-    # _boxplot(df, x="group", y="specificity", ylim=(-0.05, 1.05), title_suffix='25th% removed',
-    #          file_suffix='_25th_removed')
-    # _boxplot(df, x="group", y="precision", ylim=(-0.05, 1.05), title_suffix='25th% removed',
-    #          file_suffix='_25th_removed')
-    # _boxplot(df, x="group", y="time_on_task", ylim=(-0.05, max_time + 1), title_suffix='25th% removed',
-    #          title='Time on Task (Minutes)', file_suffix='_25th_removed')
+    # _boxplot_spec(df, x="group", y="sensitivity", ylim=(-0.05, 1.05), title_suffix='25th% removed',
+    #               file_suffix='_25th_removed')
+    # _boxplot_spec(df, x="group", y="specificity", ylim=(-0.05, 1.05), title_suffix='25th% removed',
+    #               file_suffix='_25th_removed')
+    # _boxplot_spec(df, x="group", y="precision", ylim=(-0.05, 1.05), title_suffix='25th% removed',
+    #               file_suffix='_25th_removed')
+    # _boxplot_spec(df, x="group", y="time_on_task", ylim=(-0.05, max_time + 1), title_suffix='25th% removed',
+    #               title='Time on Task (Minutes)', file_suffix='_25th_removed')
     #
     # print(df.head().to_string())
+    return plots
+
+
+def plot_user_results(df: pd.DataFrame, workers: int = None, force: bool = False) -> List[str]:
+    return render(user_plots(df), workers, force)
 
 
-def plot_decision_time(df):
-    df['mean'] = pd.to_timedelta(df['mean'], unit='day').dt.total_seconds()
+def _decision_time(df: pd.DataFrame):
     ax = sns.regplot(data=df.reset_index(), x='index', y='mean', lowess=True, line_kws={'color': 'red'})
     # Suppress title for APA7
     # ax.set_title("Mean Time to Make a Decision (s)")
     ax.set_xlabel("Order of Events")
     ax.set_ylabel("Mean Time to Decide (s)")
-    plt.tight_layout()
-    plt.savefig(PLOT_DIR / "event_decision_time.png")
-    plt.show()
 
 
-if __name__ == "__main__":
-    # Runs off the Excel sheet generated by compute_results.py
+def decision_time_plots(df: pd.DataFrame) -> List[Plot]:
+    return [Plot(_decision_time, df[['mean']], {}, "event_decision_time.png")]
+
 
-    input_file = Path('excel') / "cry-wolf_20200125_14-35-09_patched_analysis.xlsx"
-    users = pd.read_excel(input_file, sheet_name='users')
-    plot_user_results(users)
+def plot_decision_time(df: pd.DataFrame, workers: int = None, force: bool = False) -> List[str]:
+    return render(decision_time_plots(df), workers, force)
 
-    input_file = Path('excel') / "cry-wolf_20200125_14-35-09_patched_decision_time.xlsx"
-    decision_times = pd.read_excel(input_file, sheet_name='event_decision_time')
-    plot_decision_time(decision_times)
+
+if __name__ == "__main__":
+    # Runs off the results compute_results.py saved to the results_store
+    parser = argparse.ArgumentParser()
+    parser.add_argument('session', nargs='?', default='cry-wolf_20200125_14-35-09_patched',
+                        help='session in the results store')
+    parser.add_argument('--workers', type=int, help='number of worker processes')
+    parser.add_argument('--force', action='store_true', help='redraw every figure, even if it is current')
+    args = parser.parse_args()
+
+    users = load_users(args.session, ['group', '25th percentile'] + USER_MEASURES)
+    decision_times = load_decision_time(args.session)
+
+    plots = user_plots(users) + decision_time_plots(decision_times)
+    rendered = render(plots, args.workers, args.force)
+    print(f"Rendered {len(rendered)} of {len(plots)} plots to {PLOT_DIR}/: {', '.join(rendered) or 'all were current'}")
@@ -0,0 +1,177 @@
+"""
+Monte Carlo power analysis of the FAR group comparisons of compute_stats.
+
+Each FAR group is an Arm: the share of its alarms that are false and the probability that an analyst decides each of
+its true and false alarms correctly, by default the difficulty p of item_analysis (as reported by event_stats) of the
+events that group saw. A replicate draws n synthetic analysts per arm. Each gets a skill, a normal shift of SKILL_SD
+on the logit scale, and decides the arm's n_events alarms, far of them false. As in the study, every replicate of an
+arm shows the same alarms, see _session: alarms drawn anew per replicate would make the arms differ by a random
+alarm set that does not average out as n grows, and reject even between identical arms. Sensitivity, precision and
+correctness follow from the TP, FP, FN and TN counts as in compute_results, and
+the arms are compared with the two-sided Mann-Whitney U test of group_comparisons (normal approximation with tie and
+continuity corrections). The power of a measure is the share of replicates with p < alpha; comparisons with an
+undefined measure, e.g., precision without any escalation, count as not significant.
+
+Replicates are generated as (replicates, analysts, alarms) arrays, BATCH_SIZE replicates at a time, and the batches
+are spread over a process pool with the seeding of resampling.py, so results depend only on the seed.
+
+Usage: python power_analysis.py [workbook name] [--n 10 20 30 ...] [--replicates N] [--far 0.5 0.86]
+"""
+import argparse
+from typing import Dict, NamedTuple, Sequence
+
+import numpy as np
+import pandas as pd
+import scipy.stats as stats
+from scipy.special import expit, logit
+
+from compute_results import _load_decisions_from_workbook, read_table
+from group_comparisons import u_test
+from instrumentation import instrumented
+from item_analysis import analyze_items
+from models import Event
+from resampling import SEED, _run
+
+N_REPLICATES = 1000
+ALPHA = 0.05
+# Standard deviation of analyst skill on the logit scale of the probability of a correct decision
+SKILL_SD = 0.5
+SAMPLE_SIZES = [10, 15, 20, 25, 30, 40, 50, 75, 100]
+MEASURES = ['sensitivity', 'precision', 'correctness']
+# Probabilities are kept off 0 and 1 so every analyst's skill still moves them
+P_CLIP = 0.005
+
+
+class Arm(NamedTuple):
+    """
+    One FAR group of the design
+    """
+    far: float
+    true_p: np.ndarray
+    false_p: np.ndarray
+    n_events: int
+
+
+def arms_from_items(items: pd.DataFrame, events: pd.DataFrame, fars: Dict[int, float] = None,
+                    n_events: int = None) -> Dict[int, Arm]:
+    """
+    :param items: per group and event difficulties from item_analysis.analyze_items
+    :param events: Event table with 'id' and 'should_escalate' (1 for true alarms) columns
+    :param fars: share of false alarms of each group; defaults to the share among the events each group answered
+    :param n_events: alarms per analyst; defaults to the number of events each group answered
+    :return: an Arm per group
+    """
+    truth = events.set_index('id')['should_escalate'].astype(int) == 1
+    arms = {}
+    for group, difficulty in items['p'].dropna().groupby(level=0):
+        difficulty = difficulty.droplevel(0)
+        is_true = truth.reindex(difficulty.index).fillna(False).to_numpy(bool)
+        p = np.clip(difficulty.to_numpy(float), P_CLIP, 1 - P_CLIP)
+        far = fars[group] if fars and group in fars else 1 - is_true.mean()
+        arms[group] = Arm(far, p[is_true], p[~is_true], n_events or len(p))
+    return arms
+
+
+def _session(pool: np.ndarray, k: int) -> np.ndarray:
+    """
+    :return: the probabilities of k alarms of one kind: the pool itself when it holds k events, else k evenly spaced
+        quantiles of it
+    """
+    if len(pool) == k:
+        return pool
+    return np.quantile(pool, (np.arange(k) + 0.5) / k)
+
+
+def _measures(rng: np.random.Generator, arm: Arm, n: int, size: int, skill_sd: float) -> np.ndarray:
+    """
+    :return: (size, len(MEASURES), n) sensitivity, precision and correctness of size replicates of n analysts
+    """
+    n_false = int(round(arm.far * arm.n_events))
+    n_true = arm.n_events - n_false
+    skill = rng.normal(0, skill_sd, (size, n, 1))
+    true_p = _session(arm.true_p, n_true)
+    false_p = _session(arm.false_p, n_false)
+    tp = (rng.random((size, n, n_true)) < expit(logit(true_p) + skill)).sum(axis=2)
+    tn = (rng.random((size, n, n_false)) < expit(logit(false_p) + skill)).sum(axis=2)
+    fp = n_false - tn
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.stack([tp / n_true, tp / (tp + fp), (tp + tn) / arm.n_events], axis=1)
+
+
+def _tie_terms(pooled: np.ndarray) -> np.ndarray:
+    """
+    :return: sum of t^3 - t over the tie groups of each row
+    """
+    rows, n = pooled.shape
+    ordered = np.sort(pooled, axis=1)
+    new_run = np.ones_like(ordered, dtype=bool)
+    new_run[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    runs = np.cumsum(new_run, axis=1) - 1 + n * np.arange(rows)[:, None]
+    tied = np.bincount(runs.ravel(), minlength=rows * n).reshape(rows, n)
+    return (tied ** 3 - tied).sum(axis=1)
+
+
+def _power_batch(arm_x: Arm, arm_y: Arm, n_x: int, n_y: int, skill_sd: float, size: int,
+                 seed: np.random.SeedSequence) -> np.ndarray:
+    """
+    :return: (size, len(MEASURES), 2) p-values and rank-biserial effects of size replicates
+    """
+    rng = np.random.default_rng(seed)
+    x = _measures(rng, arm_x, n_x, size, skill_sd).reshape(size * len(MEASURES), n_x)
+    y = _measures(rng, arm_y, n_y, size, skill_sd).reshape(size * len(MEASURES), n_y)
+    pooled = np.concatenate([x, y], axis=1)
+    U1 = stats.rankdata(pooled, axis=1)[:, :n_x].sum(axis=1) - n_x * (n_x + 1) / 2
+    p, effect = u_test(U1, np.full(len(U1), n_x), np.full(len(U1), n_y), _tie_terms(pooled))
+    undefined = np.isnan(pooled).any(axis=1)
+    p[undefined] = effect[undefined] = np.NaN
+    return np.stack([p, effect], axis=1).reshape(size, len(MEASURES), 2)
+
+
+@instrumented()
+def simulate_power(arm_x: Arm, arm_y: Arm, sample_sizes: Sequence[int] = SAMPLE_SIZES,
+                   n_replicates: int = N_REPLICATES, alpha: float = ALPHA, skill_sd: float = SKILL_SD,
+                   seed: int = SEED, workers: int = None) -> pd.DataFrame:
+    """
+    Estimates the power of comparing arm_x and arm_y with n analysts in each, for every n in sample_sizes.
+    :param workers: number of worker processes; None uses every CPU and 1 runs in this process
+    :return: one row per sample size and measure with the columns n, measure, power, median_p, mean_effect (mean
+        rank-biserial correlation) and undefined (share of replicates in which the measure was undefined)
+    """
+    results = []
+    for n in sample_sizes:
+        # A new seed per sample size, so adding sizes to the curve does not change the others
+        outcome = _run(_power_batch, (arm_x, arm_y, n, n, skill_sd), n_replicates, seed + n, workers)
+        p, effect = outcome[..., 0], outcome[..., 1]
+        results.append(pd.DataFrame({
+            'n': n,
+            'measure': MEASURES,
+            'power': (p < alpha).mean(axis=0),
+            'median_p': np.nanmedian(p, axis=0),
+            'mean_effect': np.nanmean(effect, axis=0),
+            'undefined': np.isnan(p).mean(axis=0),
+        }))
+    return pd.concat(results, ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('workbook', nargs='?', default='cry-wolf_20200125_14-35-09_patched',
+                        help='workbook to estimate the event difficulties from')
+    parser.add_argument('--n', type=int, nargs='+', default=SAMPLE_SIZES, help='analysts per FAR group')
+    parser.add_argument('--replicates', type=int, default=N_REPLICATES)
+    parser.add_argument('--far', type=float, nargs=2, metavar=('FAR1', 'FAR3'),
+                        help='share of false alarms shown to groups 1 and 3; defaults to the observed shares')
+    parser.add_argument('--skill-sd', type=float, default=SKILL_SD)
+    parser.add_argument('--alpha', type=float, default=ALPHA)
+    parser.add_argument('--workers', type=int, help='number of worker processes')
+    args = parser.parse_args()
+
+    _users, _labeled, _summary = _load_decisions_from_workbook(args.workbook)
+    _scores = _summary[['TP', 'FP', 'FN', 'TN']]
+    _correctness = ((_scores['TP'] + _scores['TN']) / _scores.sum(axis=1)).rename('correctness')
+    _users = _users[['username', 'group']].rename(columns={'username': 'user'}).join(_correctness, on='user')
+    _arms = arms_from_items(analyze_items(_labeled, _users), read_table(args.workbook, Event),
+                            dict(zip([1, 3], args.far)) if args.far else None)
+    _power = simulate_power(_arms[1], _arms[3], args.n, args.replicates, args.alpha, args.skill_sd,
+                            workers=args.workers)
+    print(_power.pivot(index='n', columns='measure', values='power')[MEASURES].to_string(float_format='%.3f'))
@@ -0,0 +1,169 @@
+"""
+Bootstrap confidence intervals and permutation p-values for the FAR group comparisons.
+
+Resamples are drawn as whole index matrices with NumPy, BATCH_SIZE resamples at a time. Every batch gets its own
+child of one SeedSequence, so results depend only on the seed and the number of resamples, not on the number of
+workers or the order in which batches finish. Batches run in this process when the whole job draws at most
+IN_PROCESS_MAX_VALUES values, as it does for samples of the study's size, and otherwise in a process pool that is
+started once and shared by all later calls.
+
+permutation_p enumerates every relabelling of the pooled sample when there are at most EXACT_MAX_PERMUTATIONS of
+them, which gives the exact p-value; larger samples get a Monte Carlo estimate from n_resamples random relabellings.
+
+NaNs are dropped from each sample before resampling.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import combinations
+from math import comb
+from typing import Callable, Tuple
+
+import numpy as np
+import scipy.stats as stats
+
+N_RESAMPLES = 10000
+BATCH_SIZE = 1000
+SEED = 20190924
+CONFIDENCE = 0.95
+# Jobs drawing at most this many values in total run in this process, where starting a pool would cost more
+IN_PROCESS_MAX_VALUES = 5 * 10 ** 7
+EXACT_MAX_PERMUTATIONS = 10 ** 5
+
+
+def _u1(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Mann-Whitney U of x for each row of the (resamples, nx) and (resamples, ny) matrices x and y
+    """
+    nx = x.shape[1]
+    ranks = stats.rankdata(np.concatenate([x, y], axis=1), axis=1)
+    return ranks[:, :nx].sum(axis=1) - nx * (nx + 1) / 2
+
+
+def _effect_batch(x: np.ndarray, y: np.ndarray, size: int, seed: np.random.SeedSequence) -> np.ndarray:
+    """
+    Signed rank-biserial correlations, 2 U1 / (nx ny) - 1, of size bootstrap resamples of x and y, each resampled
+    independently
+    """
+    rng = np.random.default_rng(seed)
+    bx = x[rng.integers(0, len(x), (size, len(x)))]
+    by = y[rng.integers(0, len(y), (size, len(y)))]
+    return 2 * _u1(bx, by) / (len(x) * len(y)) - 1
+
+
+def _permutation_batch(pooled: np.ndarray, nx: int, size: int, seed: np.random.SeedSequence) -> np.ndarray:
+    """
+    Distance of U from its null mean for size random relabellings of the pooled sample into groups of nx and the rest
+    """
+    rng = np.random.default_rng(seed)
+    shuffled = rng.permuted(np.broadcast_to(pooled, (size, len(pooled))), axis=1)
+    ny = len(pooled) - nx
+    return np.abs(_u1(shuffled[:, :nx], shuffled[:, nx:]) - nx * ny / 2)
+
+
+def _statistic_batch(values: np.ndarray, statistic: str, size: int, seed: np.random.SeedSequence) -> np.ndarray:
+    """
+    statistic ('mean' or 'median') of size bootstrap resamples of values
+    """
+    rng = np.random.default_rng(seed)
+    resamples = values[rng.integers(0, len(values), (size, len(values)))]
+    return getattr(np, statistic)(resamples, axis=1)
+
+
+@lru_cache(maxsize=None)
+def _pool(workers: int) -> ProcessPoolExecutor:
+    """
+    :return: the process pool of this many workers, started on first use and shut down when Python exits
+    """
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def _run(batch: Callable, args: tuple, n_resamples: int, seed: int, workers: int = None,
+         values_per_resample: int = None) -> np.ndarray:
+    """
+    Evaluates batch(*args, size, seed_sequence) over n_resamples resamples, BATCH_SIZE at a time.
+    :param workers: number of worker processes; None uses every CPU, or this process for jobs drawing at most
+        IN_PROCESS_MAX_VALUES values, and 1 runs in this process
+    :param values_per_resample: values one resample draws, to size the job; None if unknown
+    :return: the concatenated statistics of all resamples
+    """
+    sizes = [BATCH_SIZE] * (n_resamples // BATCH_SIZE)
+    if n_resamples % BATCH_SIZE:
+        sizes.append(n_resamples % BATCH_SIZE)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    small = values_per_resample is not None and n_resamples * values_per_resample <= IN_PROCESS_MAX_VALUES
+    if workers is None and small:
+        workers = 1
+    workers = min(workers or os.cpu_count(), len(sizes))
+    if workers <= 1:
+        return np.concatenate([batch(*args, size, s) for size, s in zip(sizes, seeds)])
+    futures = [_pool(workers).submit(batch, *args, size, s) for size, s in zip(sizes, seeds)]
+    return np.concatenate([f.result() for f in futures])
+
+
+def _clean(values) -> np.ndarray:
+    values = np.asarray(values, dtype=float)
+    return values[~np.isnan(values)]
+
+
+def bootstrap_effect_ci(x, y, n_resamples: int = N_RESAMPLES, confidence: float = CONFIDENCE, seed: int = SEED,
+                        workers: int = None) -> Tuple[float, float]:
+    """
+    Percentile bootstrap confidence interval of the signed rank-biserial correlation 2 U1 / (nx ny) - 1 between
+    samples x and y. Its absolute value is the effect size reported by compute_results.compute_stats; the signed
+    form is used so an interval spanning 0 shows that the direction of the difference is uncertain.
+    :return: (lower, upper) bounds, NaN when either sample is empty
+    """
+    x, y = _clean(x), _clean(y)
+    if len(x) == 0 or len(y) == 0:
+        return np.NaN, np.NaN
+    effects = _run(_effect_batch, (x, y), n_resamples, seed, workers, len(x) + len(y))
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(effects, [alpha, 1 - alpha])
+    return low, high
+
+
+def _exact_null(pooled: np.ndarray, nx: int) -> np.ndarray:
+    """
+    Distance of U from its null mean for every relabelling of the pooled sample into groups of nx and the rest. The
+    pooled ranks do not change with the labelling, so U of each is a sum of nx of them.
+    """
+    ranks = stats.rankdata(pooled)
+    ny = len(pooled) - nx
+    in_x = np.array(list(combinations(range(len(pooled)), nx)), dtype=np.intp).reshape(-1, nx)
+    return np.abs(ranks[in_x].sum(axis=1) - nx * (nx + 1) / 2 - nx * ny / 2)
+
+
+def permutation_p(x, y, n_resamples: int = N_RESAMPLES, seed: int = SEED, workers: int = None) -> float:
+    """
+    Two-sided permutation p-value of the Mann-Whitney U statistic between samples x and y: exact when the pooled
+    sample has at most EXACT_MAX_PERMUTATIONS relabellings, otherwise a Monte Carlo estimate from n_resamples random
+    relabellings that includes the observed one, so it is never 0.
+    """
+    x, y = _clean(x), _clean(y)
+    if len(x) == 0 or len(y) == 0:
+        return np.NaN
+    observed = np.abs(_u1(x[None, :], y[None, :])[0] - len(x) * len(y) / 2)
+    pooled = np.concatenate([x, y])
+    # Tolerance guards against rank sums of tied values differing in the last bit
+    if comb(len(pooled), len(x)) <= EXACT_MAX_PERMUTATIONS:
+        return np.count_nonzero(_exact_null(pooled, len(x)) >= observed - 1e-9) / comb(len(pooled), len(x))
+    null = _run(_permutation_batch, (pooled, len(x)), n_resamples, seed, workers, len(pooled))
+    return (np.count_nonzero(null >= observed - 1e-9) + 1) / (n_resamples + 1)
+
+
+def bootstrap_ci(values, statistic: str = 'mean', n_resamples: int = N_RESAMPLES, confidence: float = CONFIDENCE,
+                 seed: int = SEED, workers: int = None) -> Tuple[float, float]:
+    """
+    Percentile bootstrap confidence interval of a one-sample statistic.
+    :param statistic: 'mean' or 'median'
+    :return: (lower, upper) bounds, NaN when values is empty
+    """
+    values = _clean(values)
+    if len(values) == 0:
+        return np.NaN, np.NaN
+    estimates = _run(_statistic_batch, (values, statistic), n_resamples, seed, workers, len(values))
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(estimates, [alpha, 1 - alpha])
+    return low, high
@@ -0,0 +1,159 @@
+"""
+Indexed SQLite store of the per-session results of compute_results, shared by latex.py and plot_results.py.
+
+save_results replaces one session's rows in three tables:
+- users: one row per user with the per-user measures of compute_results
+- user_events: one row per user and decided event with its outcome (TP, FP, FN, TN or IDK)
+- decision_times: one row per user and decision order with the seconds event_decision_time measured
+Every table is keyed by session and indexed by (session, group), so the reporting scripts read just the session, FAR
+groups and columns they need instead of re-reading and regrouping the analysis workbooks.
+
+The store is STORE by default; pass another path, e.g., for tests.
+"""
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import (Boolean, Column, Float, Index, Integer, MetaData, String, Table, create_engine, delete, func,
+                        insert, select)
+
+STORE = Path('results') / 'results.sqlite'
+
+metadata = MetaData()
+
+users = Table(
+    'users', metadata,
+    Column('session', String, primary_key=True),
+    Column('username', String, primary_key=True),
+    Column('group', Integer),
+    Column('time_on_task', Float),
+    Column('25th percentile', Boolean),
+    Column('decision_count', Integer),
+    Column('confidence', Float),
+    Column('TP', Integer),
+    Column('FP', Integer),
+    Column('FN', Integer),
+    Column('TN', Integer),
+    Column('i_dont_knows', Integer),
+    Column('sensitivity', Float),
+    Column('specificity', Float),
+    Column('precision', Float),
+    Column('correctness', Float),
+    Column('experience_group', String),
+    Index('users_session_group', 'session', 'group'),
+)
+
+user_events = Table(
+    'user_events', metadata,
+    Column('session', String, primary_key=True),
+    Column('username', String, primary_key=True),
+    Column('event_id', Integer, primary_key=True),
+    Column('group', Integer),
+    Column('outcome', String),
+    Index('user_events_session_group', 'session', 'group', 'event_id'),
+)
+
+decision_times = Table(
+    'decision_times', metadata,
+    Column('session', String, primary_key=True),
+    Column('username', String, primary_key=True),
+    Column('order', Integer, primary_key=True),
+    Column('group', Integer),
+    Column('seconds', Float),
+    Index('decision_times_session_group', 'session', 'group', 'order'),
+)
+
+
+@lru_cache(maxsize=None)
+def _engine(store: Path):
+    store.parent.mkdir(parents=True, exist_ok=True)
+    engine = create_engine(f'sqlite:///{store}')
+    metadata.create_all(engine)
+    return engine
+
+
+def _records(df: pd.DataFrame) -> List[dict]:
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+def save_results(session: str, users_df: pd.DataFrame, decision_time: pd.DataFrame = None, store: Path = STORE):
+    """
+    Replaces the stored results of a session.
+    :param session: name of the session, e.g., the workbook name passed to compute_results
+    :param users_df: the users DataFrame returned by compute_results, with one outcome column per event id
+    :param decision_time: the DataFrame returned by event_decision_time; its 'mean' column and 'mean_time_per_user'
+        row are derived and not stored
+    """
+    event_ids = [c for c in users_df.columns if isinstance(c, (int, np.integer))]
+    measures = users_df[[c.name for c in users.columns if c.name in users_df]].assign(session=session)
+    outcomes = users_df[['username', 'group', *event_ids]] \
+        .melt(id_vars=['username', 'group'], var_name='event_id', value_name='outcome') \
+        .dropna(subset=['outcome']).assign(session=session)
+
+    with _engine(Path(store)).begin() as conn:
+        for table in (users, user_events, decision_times):
+            conn.execute(delete(table).where(table.c.session == session))
+        conn.execute(insert(users), _records(measures))
+        if len(outcomes):
+            conn.execute(insert(user_events), _records(outcomes))
+        if decision_time is not None:
+            seconds = decision_time.drop(columns='mean', errors='ignore') \
+                .drop(index='mean_time_per_user', errors='ignore')
+            seconds = seconds.rename_axis(index='order', columns='username').stack().rename('seconds').reset_index()
+            seconds['group'] = seconds['username'].map(users_df.set_index('username')['group'])
+            conn.execute(insert(decision_times), _records(seconds.assign(session=session)))
+
+
+def _where(query, table: Table, session: str, groups: Optional[Sequence[int]]):
+    query = query.where(table.c.session == session)
+    if groups is not None:
+        query = query.where(table.c.group.in_(list(groups)))
+    return query
+
+
+def load_users(session: str, columns: Sequence[str] = None, groups: Sequence[int] = None,
+               store: Path = STORE) -> pd.DataFrame:
+    """
+    :param columns: columns of the users table to load; defaults to all but session
+    :param groups: FAR groups to load, e.g., [1, 3]; defaults to all
+    :return: one row per user of the session
+    """
+    selected = [users.c[c] for c in columns] if columns else [c for c in users.columns if c.name != 'session']
+    with _engine(Path(store)).connect() as conn:
+        return pd.read_sql(_where(select(*selected), users, session, groups), conn)
+
+
+def load_user_events(session: str, event_ids: Sequence[int] = None, groups: Sequence[int] = None,
+                     store: Path = STORE) -> pd.DataFrame:
+    """
+    :param event_ids: events to load; defaults to all
+    :return: one row per user and decided event with the columns username, group, event_id and outcome
+    """
+    query = _where(select(user_events.c.username, user_events.c.group, user_events.c.event_id,
+                          user_events.c.outcome), user_events, session, groups)
+    if event_ids is not None:
+        query = query.where(user_events.c.event_id.in_(list(event_ids)))
+    with _engine(Path(store)).connect() as conn:
+        return pd.read_sql(query, conn)
+
+
+def load_decision_time(session: str, groups: Sequence[int] = None, store: Path = STORE) -> pd.DataFrame:
+    """
+    :return: the mean seconds to decide over the session's users, by decision order, in a 'mean' column indexed by
+        order like the 'mean' column of event_decision_time
+    """
+    query = _where(select(decision_times.c.order, func.avg(decision_times.c.seconds).label('mean')),
+                   decision_times, session, groups) \
+        .group_by(decision_times.c.order).order_by(decision_times.c.order)
+    with _engine(Path(store)).connect() as conn:
+        return pd.read_sql(query, conn, index_col='order').rename_axis(index=None)
+
+
+def sessions(store: Path = STORE) -> List[str]:
+    """
+    :return: the sessions in the store
+    """
+    with _engine(Path(store)).connect() as conn:
+        return list(conn.scalars(select(users.c.session).distinct().order_by(users.c.session)))
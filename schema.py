@@ -0,0 +1,144 @@
+"""
+Compact in-memory dtypes for the Cry Wolf tables.
+
+The database stores most fields as text, e.g., login counts, "98%" VPN confidences and "4.0" decision confidences,
+and both pd.read_sql and pd.read_excel hand them over as object columns. typed() converts a loaded table to:
+- usernames in decision and click tables: category
+- escalate: a category with the three answers in a fixed order, so the codes are int8 and stable across tables
+- confidence: nullable Int8, NA for "I don't know"s without a confidence
+- percentages such as vpn_confidence: float32 percentage points, "98%" -> 98.0
+- counts, ids and flags: the smallest integer type that fits; nullable (Int16, ...) when values are missing
+- timestamps: datetime64[ns], which is stored as int64 nanoseconds
+- booleans: bool, or nullable boolean when values are missing; Postgres' t/f text is understood
+Columns without a rule, e.g., free-text answers, are left as loaded.
+
+Categorical columns keep every category after filtering, so group them with observed=True.
+"""
+from typing import Dict, Optional
+
+import pandas as pd
+from sqlalchemy import Boolean, DateTime, Float, Integer
+
+from models import (Event, EventClicked, EventDecision, PrequestionnaireAnswer, SurveyAnswer, TrainingEvent,
+                    TrainingEventDecision, User)
+
+TRUE_ALARM = 'Escalate'
+FALSE_ALARM = "Don't escalate"
+UNDECIDED = "I don't know"
+DECISIONS = pd.CategoricalDtype([TRUE_ALARM, FALSE_ALARM, UNDECIDED])
+
+# Column -> kind for columns the model's SQL type does not describe well
+SCHEMA: Dict[type, Dict[str, str]] = {
+    Event: {
+        'id': 'int16',
+        'should_escalate': 'int8',
+        'number_successful_logins1': 'int16',
+        'number_failed_logins1': 'int16',
+        'number_successful_logins2': 'int16',
+        'number_failed_logins2': 'int16',
+        'time_between_authentications': 'float32',
+        'vpn_confidence': 'percent',
+    },
+    TrainingEvent: {
+        'id': 'int16',
+        'should_escalate': 'int8',
+        'number_successful_logins1': 'int16',
+        'number_failed_logins1': 'int16',
+        'number_successful_logins2': 'int16',
+        'number_failed_logins2': 'int16',
+        'vpn_confidence': 'percent',
+    },
+    EventDecision: {'user': 'category', 'event_id': 'int16', 'escalate': 'decision', 'confidence': 'confidence'},
+    TrainingEventDecision: {'user': 'category', 'event_id': 'int16', 'escalate': 'decision',
+                            'confidence': 'confidence'},
+    EventClicked: {'user': 'category', 'event_id': 'int16'},
+    User: {'group': 'int8'},
+    SurveyAnswer: {c: 'int8' for c in ['mental', 'physical', 'temporal', 'performance', 'effort', 'frustration']},
+    PrequestionnaireAnswer: {},
+}
+
+_BOOLEAN_TEXT = {'t': True, 'true': True, '1': True, 'f': False, 'false': False, '0': False}
+
+
+def _integer(values: pd.Series, dtype: str) -> pd.Series:
+    values = pd.to_numeric(values, errors='coerce')
+    if values.isna().any():
+        # Nullable integer types are spelled with a capital, e.g., Int16
+        return values.astype(dtype.capitalize())
+    return values.astype(dtype)
+
+
+def _percent(values: pd.Series) -> pd.Series:
+    if values.dtype == object:
+        values = values.str.rstrip('%')
+    return pd.to_numeric(values, errors='coerce').astype('float32')
+
+
+def _boolean(values: pd.Series) -> pd.Series:
+    if values.dtype == object:
+        values = values.map(lambda v: _BOOLEAN_TEXT.get(v.lower(), v) if isinstance(v, str) else v)
+    return values.astype('boolean') if values.isna().any() else values.astype(bool)
+
+
+def _confidence(values: pd.Series) -> pd.Series:
+    values = pd.to_numeric(values, errors='coerce')
+    if ((values % 1).fillna(0) == 0).all():
+        return values.astype('Int8')
+    return values.astype('Float32')
+
+
+def _convert(values: pd.Series, kind: str) -> pd.Series:
+    if kind == 'category':
+        return values.astype('category')
+    if kind == 'decision':
+        return values.astype(DECISIONS)
+    if kind == 'confidence':
+        return _confidence(values)
+    if kind == 'percent':
+        return _percent(values)
+    if kind == 'datetime':
+        # Parquet and Feather exports load as datetime64[us]; the analysis assumes nanoseconds throughout
+        return pd.to_datetime(values).dt.as_unit('ns')
+    if kind == 'bool':
+        return _boolean(values)
+    if kind.startswith('int'):
+        return _integer(values, kind)
+    return values.astype(kind)
+
+
+def _kind(column) -> Optional[str]:
+    """
+    Default kind of a column from its SQL type
+    """
+    if isinstance(column.type, DateTime):
+        return 'datetime'
+    if isinstance(column.type, Boolean):
+        return 'bool'
+    if isinstance(column.type, Integer):
+        return 'int32'
+    if isinstance(column.type, Float):
+        return 'float64'
+    return None
+
+
+def kinds(model) -> Dict[str, Optional[str]]:
+    """
+    :return: the kind of every column of a table, e.g., 'int16', 'category' or 'percent'; None for columns left as
+        loaded
+    """
+    overrides = SCHEMA.get(model, {})
+    return {column.name: overrides.get(column.name) or _kind(column) for column in model.__table__.columns}
+
+
+def typed(model, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    :param model: the models.py class of the table
+    :param df: the table as loaded from a workbook or the database
+    :return: a copy of df with compact dtypes, see the module docstring
+    """
+    df = df.copy()
+    for name, kind in kinds(model).items():
+        if kind and name in df:
+            df[name] = _convert(df[name], kind)
+    return df
+
@@ -0,0 +1,309 @@
+"""
+Generates synthetic Cry Wolf data sets at any scale, to measure how the analysis scales beyond the existing backups.
+
+The tables have the columns of models.py and the dtypes of the backup workbooks. Participants are split between the
+50% (group 1) and 86% (group 3) false alarm rate groups and are shown EVENTS_PER_USER events at their group's false
+alarm rate, plus the two check events. A share of their decisions is resubmitted, sometimes with a different answer
+and always after a revisit click, and a share is "I don't know". A few users register but never start, as in the
+real sessions. Generation is seeded and vectorized, so 10^6 decisions take seconds.
+
+Workbooks are written to SYNTHETIC_DIR, not backups/, so batch_results never mistakes them for a session; pass the
+workbook's path as the source of compute_results.read_table to analyze one.
+
+Usage: python synthetic_data.py <number of decisions> [--seed SEED] [--db URL | --xlsx FILE]
+"""
+import argparse
+import string
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import MetaData, String, create_engine
+
+from compute_results import CHECK_EVENT_IDS, FALSE_ALARM, TRUE_ALARM, UNDECIDED
+from models import (Event, EventClicked, EventDecision, PrequestionnaireAnswer, SurveyAnswer, TrainingEvent,
+                    TrainingEventDecision, User, metadata)
+
+SEED = 20190924
+SYNTHETIC_DIR = Path('synthetic')
+START = np.datetime64('2019-09-25T15:00:00', 'ms')
+
+# Event pool: ids 1-73 are regular alarms, 74 and 75 the check events (one true and one false alarm)
+N_TRUE_ALARMS = 30
+N_FALSE_ALARMS = 43
+EVENTS_PER_USER = 50
+FAR = {1: 0.5, 3: 0.86}
+# Mean seconds from opening an event to deciding it, per group
+THINK_SECONDS = {1: 15.5, 3: 21.5}
+
+RESUBMIT_RATE = 0.02
+CHANGE_RATE = 0.5
+IDK_RATE = 0.01
+INCOMPLETE_RATE = 0.05
+CONFIDENCE_P = [0.01, 0.07, 0.24, 0.47, 0.21]
+
+ANSWERS = {
+    'role': ['Student', 'Software Engineering', 'Researcher', 'IT/Network Administrator'],
+    'exp_researcher': ['No Experience', '< 1', '1 - 5', '5 - 10'],
+    'exp_admin': ['No Experience', '< 1', '1 - 5', '5 - 10'],
+    'exp_software': ['No Experience', '< 1', '1 - 5', '5 - 10'],
+    'exp_security': ['No Experience', '< 1', '1 - 5'],
+    'subnet_mask': ['255.255.255.0', '173.67.14.0', 'I don’t know', '255.255.255.24'],
+    'network_address': ['173.67.14.0', '173.67.14.127', 'I don’t know', '255.255.255.0'],
+    'tcp_faster': ['False', 'True', 'I don’t know'],
+    'http_port': ['80', '443', '587', '5000', 'I don’t know'],
+    'firewall': ['Firewall', 'Intrusion Detection System', 'I don’t know'],
+    'socket': ['Socket', 'Protocol', 'MAC Address', 'Ping', 'I don’t know'],
+    'which_model': ['TCP/IP', 'OSI', 'HTTPS', 'I don’t know'],
+}
+CITIES = ['Tokyo', 'Moscow', 'Beijing', 'Los Angeles', 'New York', 'London', 'Paris', 'Sydney', 'Lagos', 'Rio']
+PROVIDERS = ['Telecom', 'Hosting/server', 'Cellular']
+
+
+def _columns(model) -> list:
+    return [c.name for c in model.__table__.columns]
+
+
+def _events(rng: np.random.Generator) -> pd.DataFrame:
+    n = N_TRUE_ALARMS + N_FALSE_ALARMS + len(CHECK_EVENT_IDS)
+    should_escalate = np.r_[rng.permutation(np.r_[np.ones(N_TRUE_ALARMS, int), np.zeros(N_FALSE_ALARMS, int)]), 1, 0]
+    return pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'should_escalate': should_escalate,
+        'country_of_authentication1': rng.choice(CITIES, n),
+        'number_successful_logins1': rng.integers(0, 15, n).astype(str),
+        'number_failed_logins1': rng.integers(0, 5, n).astype(str),
+        'source_provider1': rng.choice(PROVIDERS, n),
+        'country_of_authentication2': rng.choice(CITIES, n),
+        'number_successful_logins2': rng.integers(0, 15, n).astype(str),
+        'number_failed_logins2': rng.integers(0, 5, n).astype(str),
+        'source_provider2': rng.choice(PROVIDERS, n),
+        'time_between_authentications': rng.uniform(0, 3, n).round(2),
+        'vpn_confidence': [f'{c}%' for c in rng.integers(50, 100, n)],
+    })[_columns(Event)]
+
+
+def _strings(codes: np.ndarray, length: int, alphabet: str) -> np.ndarray:
+    """
+    Spells each integer code as length characters of alphabet
+    """
+    digits = (codes[:, None] // len(alphabet) ** np.arange(length)) % len(alphabet)
+    return np.array(list(alphabet))[digits].view(f'U{length}').ravel()
+
+
+def _usernames(rng: np.random.Generator, groups: np.ndarray) -> np.ndarray:
+    """
+    Distinct usernames of random lowercase letters followed by the group digit, like 'lnlx1'
+    """
+    letters = 4
+    while 26 ** letters < 2 * len(groups):
+        letters += 1
+    stems = _strings(rng.choice(26 ** letters, len(groups), replace=False), letters, string.ascii_lowercase)
+    return np.char.add(stems, groups.astype(str))
+
+
+def _shown_events(rng: np.random.Generator, events: pd.DataFrame, groups: np.ndarray, k: int) -> np.ndarray:
+    """
+    :return: (users, k + 2) event ids in the order each user is shown them: k regular events at the user's group's
+        false alarm rate plus the check events
+    """
+    regular = events[~events['id'].isin(CHECK_EVENT_IDS)]
+    true_ids = regular.loc[regular.should_escalate == 1, 'id'].to_numpy()
+    false_ids = regular.loc[regular.should_escalate == 0, 'id'].to_numpy()
+    shown = np.empty((len(groups), k + len(CHECK_EVENT_IDS)), dtype=int)
+    for group in np.unique(groups):
+        members = np.flatnonzero(groups == group)
+        # Users of other groups only appear among those who never started; show them the 50% FAR
+        far = FAR.get(group, FAR[1])
+        n_false = min(round(far * k), len(false_ids))
+        n_true = k - n_false
+        pick_true = np.argsort(rng.random((len(members), len(true_ids))), axis=1)[:, :n_true]
+        pick_false = np.argsort(rng.random((len(members), len(false_ids))), axis=1)[:, :n_false]
+        shown[members] = np.concatenate([true_ids[pick_true], false_ids[pick_false],
+                                         np.broadcast_to(CHECK_EVENT_IDS, (len(members), len(CHECK_EVENT_IDS)))],
+                                        axis=1)
+    order = np.argsort(rng.random(shown.shape), axis=1)
+    return np.take_along_axis(shown, order, axis=1)
+
+
+def _decide(rng: np.random.Generator, truth: np.ndarray, skill: np.ndarray):
+    """
+    :return: (escalate, confidence) for decisions on alarms with the given truth (1 = true alarm) by users who are
+        right with probability skill
+    """
+    correct = rng.random(len(truth)) < skill
+    escalate = np.where((truth == 1) == correct, TRUE_ALARM, FALSE_ALARM).astype(object)
+    confidence = rng.choice(np.arange(1, 6), len(truth), p=CONFIDENCE_P).astype(float)
+    undecided = rng.random(len(truth)) < IDK_RATE
+    escalate[undecided] = UNDECIDED
+    # Most "I don't know"s come without a confidence
+    confidence[undecided & (rng.random(len(truth)) < 0.6)] = np.nan
+    return escalate, confidence
+
+
+def generate(n_decisions: int, seed: int = SEED) -> Dict[str, pd.DataFrame]:
+    """
+    :param n_decisions: approximate number of EventDecision rows
+    :return: the User, Event, EventDecision, EventClicked, PrequestionnaireAnswer and SurveyAnswer tables, keyed
+        by the models.py class name (which is also the sheet name in the workbooks)
+    """
+    rng = np.random.default_rng(seed)
+    per_user = EVENTS_PER_USER + len(CHECK_EVENT_IDS)
+    # At least a few users per group, with fewer events each for small data sets
+    n_users = max(6, n_decisions // per_user)
+    k = int(np.clip(n_decisions // n_users - len(CHECK_EVENT_IDS), 1, EVENTS_PER_USER))
+    events = _events(rng)
+
+    groups = np.resize(list(FAR), n_users)
+    skill = rng.uniform(0.55, 0.9, n_users)
+    shown = _shown_events(rng, events, groups, k)
+    n_shown = shown.shape[1]
+
+    # Per user, click an event, think, decide, move on; times are milliseconds since the user began
+    gap = rng.uniform(500, 5000, shown.shape)
+    think_mean = np.vectorize(THINK_SECONDS.get)(groups)[:, None] * 1000
+    think = rng.lognormal(np.log(think_mean), 0.35, shown.shape)
+    decided_at = np.cumsum(gap + think, axis=1)
+    clicked_at = decided_at - think
+    begin = START + rng.uniform(0, 3600e3, n_users).astype('timedelta64[ms]')
+
+    user_idx = np.repeat(np.arange(n_users), n_shown)
+    event_ids = shown.ravel()
+    truth = events.set_index('id').should_escalate.to_numpy()[event_ids - 1]
+    escalate, confidence = _decide(rng, truth, skill[user_idx])
+    decision_time = begin[user_idx] + decided_at.ravel().astype('timedelta64[ms]')
+    click_time = begin[user_idx] + clicked_at.ravel().astype('timedelta64[ms]')
+
+    # Resubmissions: revisit an event later, click it again and decide again, possibly differently
+    resubmit = np.flatnonzero(rng.random(len(user_idx)) < RESUBMIT_RATE)
+    later = rng.uniform(10e3, 600e3, len(resubmit)).astype('timedelta64[ms]')
+    reclick_time = decision_time[resubmit] + later
+    redecision_time = reclick_time + rng.uniform(2e3, 20e3, len(resubmit)).astype('timedelta64[ms]')
+    new_escalate, new_confidence = _decide(rng, truth[resubmit], skill[user_idx[resubmit]])
+    keep = rng.random(len(resubmit)) >= CHANGE_RATE
+    new_escalate[keep] = escalate[resubmit][keep]
+    new_confidence[keep] = confidence[resubmit][keep]
+
+    end = pd.Series(np.r_[decision_time, redecision_time]).groupby(np.r_[user_idx, user_idx[resubmit]]).max() \
+        .to_numpy() + rng.uniform(30e3, 120e3, n_users).astype('timedelta64[ms]')
+    all_groups = np.r_[groups, rng.integers(1, 4, max(1, round(n_users * INCOMPLETE_RATE)))]
+    usernames = _usernames(rng, all_groups)
+
+    decisions = pd.DataFrame({
+        'user': usernames[np.r_[user_idx, user_idx[resubmit]]],
+        'event_id': np.r_[event_ids, event_ids[resubmit]],
+        'escalate': np.r_[escalate, new_escalate],
+        'confidence': np.r_[confidence, new_confidence],
+        'time_event_decision': np.r_[decision_time, redecision_time].astype('datetime64[ns]'),
+    }).sort_values('time_event_decision', kind='stable', ignore_index=True)
+    decisions.insert(0, 'id', np.arange(1, len(decisions) + 1))
+
+    clicks = pd.DataFrame({
+        'user': usernames[np.r_[user_idx, user_idx[resubmit]]],
+        'event_id': np.r_[event_ids, event_ids[resubmit]],
+        'time_event_click': np.r_[click_time, reclick_time].astype('datetime64[ns]'),
+    }).sort_values('time_event_click', kind='stable', ignore_index=True)
+    clicks.insert(0, 'id', np.arange(1, len(clicks) + 1))
+
+    # Users who registered but never started have no times, answers or decisions
+    n_all = len(usernames)
+    complete = np.arange(n_all) < n_users
+    time_begin = np.full(n_all, np.datetime64('NaT'), 'datetime64[ns]')
+    time_end = time_begin.copy()
+    time_begin[:n_users] = begin
+    time_end[:n_users] = end
+    users = pd.DataFrame({
+        'id': np.arange(1, n_all + 1),
+        'username': usernames,
+        'group': all_groups,
+        'time_begin': time_begin,
+        'time_end': time_end,
+        'events': [','.join(map(str, row)) for row in
+                   np.r_[shown, _shown_events(rng, events, all_groups[n_users:], k)]],
+        'questionnaire_complete': complete,
+        'training_complete': complete,
+        'experiment_complete': complete,
+        'survey_complete': complete,
+        'completion_code': _strings(rng.integers(0, 36 ** 6, n_all), 6, string.ascii_uppercase + string.digits),
+    })[_columns(User)]
+
+    quest = pd.DataFrame({'id': np.arange(1, n_users + 1),
+                          'timestamp': (begin - rng.uniform(60e3, 300e3, n_users).astype('timedelta64[ms]'))
+                          .astype('datetime64[ns]'),
+                          'user': usernames[:n_users]})
+    for column, answers in ANSWERS.items():
+        # The first answer is picked half the time; for the knowledge questions it is the right one
+        p = np.r_[0.5, np.full(len(answers) - 1, 0.5 / (len(answers) - 1))]
+        quest[column] = rng.choice(answers, n_users, p=p)
+    for column in ['familiarity_none', 'familiarity_read', 'familiarity_controlled', 'familiarity_public',
+                   'familiarity_engineered']:
+        quest[column] = rng.random(n_users) < 0.3
+    quest = quest[_columns(PrequestionnaireAnswer)]
+
+    survey = pd.DataFrame({'id': np.arange(1, n_users + 1),
+                           'timestamp': end.astype('datetime64[ns]'),
+                           'user': usernames[:n_users],
+                           **{c: rng.integers(1, 11, n_users) for c in
+                              ['mental', 'physical', 'temporal', 'performance', 'effort', 'frustration']},
+                           'useful_info': None,
+                           'feedback': None})[_columns(SurveyAnswer)]
+
+    return {'User': users, 'Event': events, 'EventDecision': decisions[_columns(EventDecision)],
+            'EventClicked': clicks[_columns(EventClicked)], 'PrequestionnaireAnswer': quest, 'SurveyAnswer': survey}
+
+
+def to_database(tables: Dict[str, pd.DataFrame], db_url: str, chunk_size: int = 100000):
+    """
+    Creates the Cry Wolf tables in an empty database and loads tables into them. The training tables are created
+    empty. Server-side id sequences are left out, so this also works on SQLite.
+    """
+    engine = create_engine(db_url)
+    plain = MetaData()
+    for table in metadata.sorted_tables:
+        copy = table.to_metadata(plain)
+        for column in copy.columns:
+            column.server_default = None
+    plain.create_all(engine)
+
+    for model in [User, Event, EventDecision, EventClicked, PrequestionnaireAnswer, SurveyAnswer]:
+        df = tables[model.__name__].copy()
+        # Columns the models declare as text hold numbers in the workbooks, e.g., should_escalate and confidence
+        for column in model.__table__.columns:
+            if isinstance(column.type, String) and df[column.name].dtype != object:
+                values = df[column.name]
+                df[column.name] = values.astype(object).where(values.notna(), None)
+                df.loc[values.notna(), column.name] = values[values.notna()].map(str)
+        df.to_sql(model.__tablename__, engine, if_exists='append', index=False, chunksize=chunk_size)
+    engine.dispose()
+
+
+def to_workbook(tables: Dict[str, pd.DataFrame], excel_file):
+    """
+    Writes tables to a workbook with the sheets of a dump_db_to_excel export.
+    """
+    Path(excel_file).parent.mkdir(parents=True, exist_ok=True)
+    with pd.ExcelWriter(excel_file, engine='openpyxl') as writer:
+        for model in [User, PrequestionnaireAnswer, TrainingEvent, TrainingEventDecision, Event, EventClicked,
+                      EventDecision, SurveyAnswer]:
+            df = tables.get(model.__name__, pd.DataFrame(columns=_columns(model)))
+            df.to_excel(writer, sheet_name=model.__name__, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('n_decisions', type=int, help='approximate number of event decisions')
+    parser.add_argument('--seed', type=int, default=SEED)
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('--db', help='SQLAlchemy URL of an empty database to load the tables into')
+    output.add_argument('--xlsx', type=Path,
+                        help=f'workbook to write, default: {SYNTHETIC_DIR}/synthetic_<n_decisions>.xlsx')
+    args = parser.parse_args()
+
+    _tables = generate(args.n_decisions, args.seed)
+    for _name, _df in _tables.items():
+        print(f'{_name}: {len(_df)} rows')
+    if args.db:
+        to_database(_tables, args.db)
+    else:
+        to_workbook(_tables, args.xlsx or SYNTHETIC_DIR / f'synthetic_{args.n_decisions}.xlsx')
@@ -0,0 +1,38 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from download_and_import import database_for, download_and_import_all
+
+FAKES = Path(__file__).parent / 'fakes'
+APPS = {'cry-wolf': database_for('cry-wolf'), 'cry-wolf-2': database_for('cry-wolf-2')}
+
+
+def _import_all(snapshots_dir: Path, force: bool = False):
+    return asyncio.run(download_and_import_all(APPS, snapshots_dir, 'password', 'localhost', 'postgres', force=force,
+                                               heroku=str(FAKES / 'heroku'), pg_restore=str(FAKES / 'pg_restore'),
+                                               createdb=str(FAKES / 'createdb')))
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    databases = tmp_path / 'server'
+    databases.mkdir()
+    monkeypatch.setenv('FAKE_PG_DIR', str(databases))
+    return databases
+
+
+def test_apps_are_restored_into_new_databases(tmp_path, server):
+    results = _import_all(tmp_path / 'snapshots')
+    assert all('error' not in r for r in results.values()), results
+    for app, database in APPS.items():
+        assert (server / database).read_text() == f'PGDMP fixture of {app}\n'
+
+
+def test_existing_databases_are_restored_into_again(tmp_path, server):
+    _import_all(tmp_path / 'snapshots')
+    results = _import_all(tmp_path / 'snapshots', force=True)
+    assert all('error' not in r for r in results.values()), results
+    for app, database in APPS.items():
+        assert (server / database).read_text() == f'PGDMP fixture of {app}\n' * 2
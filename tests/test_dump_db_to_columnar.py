@@ -0,0 +1,18 @@
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+from compute_results import compute_results
+from dump_db_to_columnar import FORMATS, export_tables
+from synthetic_data import generate, to_database
+
+
+@pytest.mark.parametrize('fmt', list(FORMATS))
+def test_export_gives_the_same_results_as_the_database(tmp_path, fmt):
+    db_url = f'sqlite:///{tmp_path / "synthetic.db"}'
+    to_database(generate(3000), db_url)
+    engine = create_engine(db_url)
+    export_tables(engine, tmp_path / fmt, fmt)
+    engine.dispose()
+
+    pd.testing.assert_frame_equal(compute_results(str(tmp_path / fmt)), compute_results(db_url), check_dtype=False)
@@ -0,0 +1,30 @@
+import pandas as pd
+
+from compute_results import compute_results, read_table
+from incremental_results import IncrementalResults
+from models import Event, EventDecision, User
+
+SOURCE = 'cry-wolf_20200125_14-35-09_patched'
+COLUMNS = ['username', 'group', 'decision_count', 'confidence', 'TP', 'FP', 'FN', 'TN', 'i_dont_knows', 'sensitivity',
+           'specificity', 'precision', 'correctness']
+
+
+def test_metrics_agree_with_compute_results():
+    decisions, events = read_table(SOURCE, EventDecision), read_table(SOURCE, Event)
+    state = IncrementalResults()
+    # Two snapshots: the first half of the decisions, then all of them
+    state.apply(decisions[decisions['id'] <= decisions['id'].median()], events)
+    state.apply(decisions, events)
+
+    expected = compute_results(SOURCE)[COLUMNS]
+    pd.testing.assert_frame_equal(state.metrics(read_table(SOURCE, User))[COLUMNS], expected, check_dtype=False)
+
+
+def test_metrics_leave_out_incomplete_users():
+    state = IncrementalResults()
+    state.apply(read_table(SOURCE, EventDecision), read_table(SOURCE, Event))
+    users = read_table(SOURCE, User)
+    incomplete = state.tallies.index[0]
+    users.loc[users['username'] == incomplete, 'time_end'] = pd.NaT
+
+    assert incomplete not in set(state.metrics(users)['username'])
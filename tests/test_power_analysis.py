@@ -0,0 +1,13 @@
+import numpy as np
+
+from power_analysis import ALPHA, MEASURES, Arm, simulate_power
+
+
+def test_identical_arms_reject_at_about_alpha():
+    # Heterogeneous difficulties, where a per-replicate alarm draw used to make identical arms differ
+    rng = np.random.default_rng(0)
+    arm = Arm(0.5, rng.uniform(0.2, 0.99, 30), rng.uniform(0.2, 0.99, 30), 60)
+    power = simulate_power(arm, arm, [30, 100], n_replicates=2000, seed=1, workers=1)
+    assert list(power['measure'].unique()) == MEASURES
+    assert (power['power'] < ALPHA + 0.02).all()
+    assert (power['power'] > ALPHA - 0.03).all()
@@ -0,0 +1,16 @@
+import numpy as np
+import scipy.stats as stats
+
+from resampling import permutation_p
+
+
+def _distance(x, y, axis):
+    return np.abs(stats.mannwhitneyu(x, y, axis=axis).statistic - x.shape[axis] * y.shape[axis] / 2)
+
+
+def test_small_samples_get_the_exact_permutation_p():
+    rng = np.random.default_rng(3)
+    x, y = rng.integers(0, 5, 8).astype(float), rng.integers(1, 6, 7).astype(float)
+    exact = stats.permutation_test((x, y), _distance, permutation_type='independent', n_resamples=np.inf,
+                                   alternative='greater', vectorized=True)
+    assert np.isclose(permutation_p(x, y), exact.pvalue)
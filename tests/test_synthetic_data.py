@@ -0,0 +1,14 @@
+import pandas as pd
+
+from compute_results import compute_results
+from synthetic_data import generate, to_database, to_workbook
+
+
+def test_database_and_workbook_give_the_same_results(tmp_path):
+    tables = generate(3000)
+    db_url = f'sqlite:///{tmp_path / "synthetic.db"}'
+    to_database(tables, db_url)
+    to_workbook(tables, tmp_path / 'synthetic.xlsx')
+
+    pd.testing.assert_frame_equal(compute_results(db_url), compute_results(str(tmp_path / 'synthetic.xlsx')),
+                                  check_dtype=False)
@@ -0,0 +1,191 @@
+"""
+Sweep of time-on-task exclusion thresholds for the FAR group comparisons.
+
+For every threshold q of a grid the fastest participants are those with time_on_task <= np.quantile(time_on_task, q),
+the definition analyze_fastest_quantile and the '25th percentile' column use. Three comparisons are made per
+threshold and dependent variable, with the same statistics as group_comparisons.compare_groups:
+- 'fastest 50% FAR' and 'fastest 86% FAR': the fastest of the group (x) against the rest of it (y)
+- 'excluding fastest': the 50% FAR group (x) against the 86% FAR group (y), both without their fastest
+
+Participants are sorted by time_on_task once, so the fastest are a prefix and the others a suffix of that order.
+Within a group the pooled sample never changes, so U of the fastest is a prefix sum of the group's ranks. The pooled
+sample of 'excluding fastest' grows as the threshold falls; it is built by adding participants slowest first and
+updating U and the tie correction with Fenwick trees of the two groups' value counts. Means come from prefix sums.
+"""
+from typing import List, Sequence
+
+import numpy as np
+import pandas as pd
+import scipy.stats as stats
+
+from group_comparisons import EXACT_MAX_N, u_test
+from instrumentation import instrumented
+
+# Thresholds every 1% from 5% to 50%
+QUANTILES = np.round(np.arange(5, 51) / 100, 2)
+# group 1 = 50% FAR, group 3 = 86% FAR
+FAR_GROUPS = {'50% FAR': 1, '86% FAR': 3}
+
+
+class _Fenwick:
+    """
+    Counts of values by dense rank with O(log n) updates and prefix counts
+    """
+    __slots__ = ('tree', 'counts')
+
+    def __init__(self, size: int):
+        self.tree = np.zeros(size + 1, dtype=np.int64)
+        self.counts = np.zeros(size, dtype=np.int64)
+
+    def add(self, rank: int):
+        self.counts[rank] += 1
+        i = rank + 1
+        while i < len(self.tree):
+            self.tree[i] += 1
+            i += i & -i
+
+    def below(self, rank: int) -> int:
+        """
+        :return: number of values with a dense rank < rank
+        """
+        total, i = 0, rank
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+
+def _prefix(values: np.ndarray) -> np.ndarray:
+    return np.r_[0, np.cumsum(values)]
+
+
+def _tie_term(values: np.ndarray) -> float:
+    _, counts = np.unique(values, return_counts=True)
+    return float((counts ** 3 - counts).sum())
+
+
+def _within_group(values: np.ndarray, k: np.ndarray):
+    """
+    Fastest k of a group, in time order, against the rest of it.
+    :param values: the group's values of one dependent variable, sorted by time_on_task
+    :param k: number of the group's fastest for each threshold
+    :return: dict of the comparison's columns, one entry per threshold
+    """
+    n = len(values)
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0)
+    sums, counts = _prefix(filled), _prefix(present)
+    n1, n2 = k, n - k
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_x = sums[k] / counts[k]
+        mean_y = (sums[-1] - sums[k]) / (counts[-1] - counts[k])
+
+    if present.all():
+        U1 = _prefix(stats.rankdata(values))[k] - n1 * (n1 + 1) / 2
+        tie_term = np.full(len(k), _tie_term(values))
+        has_ties = len(np.unique(values)) < n
+    else:
+        # scipy gives NaN when a sample holds a NaN; the pooled sample is the whole group at every threshold
+        U1 = np.full(len(k), np.NaN)
+        tie_term = np.zeros(len(k))
+        has_ties = True
+    p, effect = u_test(U1, n1, n2, tie_term)
+
+    for i in np.flatnonzero(((n1 <= EXACT_MAX_N) | (n2 <= EXACT_MAX_N)) & (n1 > 0) & (n2 > 0) & ~has_ties
+                            & present.all()):
+        p[i] = stats.mannwhitneyu(values[:k[i]], values[k[i]:]).pvalue
+    return {'n1': n1, 'n2': n2, 'mean_x': mean_x, 'mean_y': mean_y, 'U1': U1, 'p': p, 'effect': effect}
+
+
+def _between_groups(values: np.ndarray, in_x: np.ndarray, in_y: np.ndarray, k: np.ndarray):
+    """
+    Group x against group y, both restricted to the participants after the first k of the time order.
+    :param values: one dependent variable of all participants, sorted by time_on_task
+    :param in_x: membership of group x, in the same order
+    :param in_y: membership of group y, in the same order
+    :param k: number of fastest participants excluded for each threshold
+    :return: dict of the comparison's columns, one entry per threshold
+    """
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0)
+    columns = {}
+    for name, member in (('x', in_x), ('y', in_y)):
+        sums, counts, sizes = _prefix(filled * member), _prefix(present & member), _prefix(member)
+        columns[f'n{name}'] = sizes[-1] - sizes[k]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            columns[f'mean_{name}'] = (sums[-1] - sums[k]) / (counts[-1] - counts[k])
+    nans = _prefix(~present & (in_x | in_y))
+    has_nan = nans[-1] - nans[k] > 0
+
+    # Grow the pooled sample slowest first and record U1, ties and the tie term each time a threshold is reached
+    distinct, dense = np.unique(np.where(present, values, np.inf), return_inverse=True)
+    x_tree, y_tree = _Fenwick(len(distinct)), _Fenwick(len(distinct))
+    U1, tie_term, ties = 0.0, 0, False
+    at_k = {}
+    position = len(values)
+    for threshold in sorted(set(k), reverse=True):
+        while position > threshold:
+            position -= 1
+            if not present[position] or not (in_x[position] or in_y[position]):
+                continue
+            r = dense[position]
+            tied = x_tree.counts[r] + y_tree.counts[r]
+            if in_x[position]:
+                U1 += y_tree.below(r) + y_tree.counts[r] / 2
+                x_tree.add(r)
+            else:
+                U1 += (x_tree.below(len(distinct)) - x_tree.below(r + 1)) + x_tree.counts[r] / 2
+                y_tree.add(r)
+            tie_term += 3 * tied ** 2 + 3 * tied
+            ties = ties or tied > 0
+        at_k[threshold] = (U1, tie_term, ties)
+
+    n1, n2 = columns['nx'], columns['ny']
+    U1 = np.array([at_k[t][0] for t in k], dtype=float)
+    has_ties = np.array([at_k[t][2] for t in k])
+    p, effect = u_test(U1, n1, n2, np.array([at_k[t][1] for t in k], dtype=float))
+
+    for i in np.flatnonzero(((n1 <= EXACT_MAX_N) | (n2 <= EXACT_MAX_N)) & (n1 > 0) & (n2 > 0) & ~has_ties
+                            & ~has_nan):
+        p[i] = stats.mannwhitneyu(values[k[i]:][in_x[k[i]:]], values[k[i]:][in_y[k[i]:]]).pvalue
+    U1[has_nan] = p[has_nan] = effect[has_nan] = np.NaN
+    return {'n1': n1, 'n2': n2, 'mean_x': columns['mean_x'], 'mean_y': columns['mean_y'], 'U1': U1, 'p': p,
+            'effect': effect}
+
+
+@instrumented()
+def sweep_thresholds(users: pd.DataFrame, deps: List[str], quantiles: Sequence[float] = QUANTILES) -> pd.DataFrame:
+    """
+    :param users: one row per user with 'group', 'time_on_task' and the deps columns, e.g., from compute_results
+    :param deps: names of the dependent variable columns to compare
+    :param quantiles: thresholds, as shares of all participants, that define the fastest
+    :return: a tidy DataFrame with one row per threshold, comparison and dependent variable and the columns quantile,
+        cutoff (time_on_task at the threshold), comparison, dep and the statistics of compare_groups: n1, n2, mean_x,
+        mean_y, U1, p and effect. Comparisons with an empty sample have NaN U1, p and effect.
+    """
+    quantiles = np.asarray(quantiles, dtype=float)
+    time_on_task = users['time_on_task'].to_numpy(float)
+    order = np.argsort(time_on_task, kind='stable')
+    sorted_time = time_on_task[order]
+    cutoffs = np.quantile(time_on_task, quantiles)
+    # The fastest at each threshold are the first k participants in time order
+    k = np.searchsorted(sorted_time, cutoffs, side='right')
+    group = users['group'].to_numpy()[order]
+    in_far = {label: group == g for label, g in FAR_GROUPS.items()}
+
+    results = []
+    for dep in deps:
+        values = users[dep].to_numpy(float)[order]
+        for label, member in in_far.items():
+            positions = np.flatnonzero(member)
+            stats_ = _within_group(values[positions], np.searchsorted(positions, k))
+            results.append(pd.DataFrame({'quantile': quantiles, 'cutoff': cutoffs, 'comparison': f'fastest {label}',
+                                         'dep': dep, **stats_}))
+        stats_ = _between_groups(values, in_far['50% FAR'], in_far['86% FAR'], k)
+        results.append(pd.DataFrame({'quantile': quantiles, 'cutoff': cutoffs, 'comparison': 'excluding fastest',
+                                     'dep': dep, **stats_}))
+
+    table = pd.concat(results, ignore_index=True)
+    empty = (table['n1'] == 0) | (table['n2'] == 0)
+    table.loc[empty, ['U1', 'p', 'effect']] = np.NaN
+    return table.sort_values('quantile', kind='stable', ignore_index=True)
@@ -0,0 +1,66 @@
+"""
+Content-hashed cache for the sheets of the Cry Wolf backup workbooks.
+
+Parsing a workbook through openpyxl is the slowest step of every analysis run. The first time a sheet is read it is
+written to CACHE_DIR as an uncompressed Feather (Arrow IPC) file under the SHA-256 of the workbook's bytes; later reads
+memory-map that file instead. Rewriting a workbook changes its hash, so stale entries are never served. Corrections
+from patches.py are applied after the read, so patched and unpatched loads share one entry. Delete CACHE_DIR to
+reclaim the space.
+"""
+import hashlib
+import os
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+CACHE_DIR = Path('cache')
+
+# (resolved path, size, mtime) -> sha256, so a workbook is hashed once per process rather than once per sheet
+_hashes = {}
+
+
+def workbook_hash(input_file) -> str:
+    """
+    :param input_file: path to an Excel workbook
+    :return: the hex SHA-256 digest of the workbook's contents
+    """
+    path = Path(input_file)
+    stat = path.stat()
+    key = (path.resolve(), stat.st_size, stat.st_mtime_ns)
+    if key not in _hashes:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        _hashes[key] = sha.hexdigest()
+    return _hashes[key]
+
+
+def read_sheet(input_file, sheet_name: str) -> pd.DataFrame:
+    """
+    Drop-in replacement for pd.read_excel(input_file, sheet_name=sheet_name) that serves repeated reads from the cache.
+    :param input_file: path to an Excel workbook
+    :param sheet_name: name of the sheet to load, e.g., 'EventDecision'
+    :return: the sheet as a DataFrame
+    """
+    cache_file = CACHE_DIR / workbook_hash(input_file) / f'{sheet_name}.feather'
+    if cache_file.exists():
+        return feather.read_table(cache_file, memory_map=True).to_pandas()
+
+    df = pd.read_excel(input_file, sheet_name=sheet_name)
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # A column mixing e.g. numbers and text has no Arrow type; serve this sheet uncached
+        return df
+
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename so an interrupted run, or another process caching the same sheet, never leaves a truncated
+    # cache entry behind
+    tmp_file = cache_file.with_suffix(f'.{os.getpid()}.tmp')
+    feather.write_feather(table, tmp_file, compression='uncompressed')
+    tmp_file.replace(cache_file)
+    # Return the round-tripped frame so cold and warm runs see identical values
+    return table.to_pandas()